@@ -0,0 +1,76 @@
+# Names of enemies (teki) and treasures, read from resources/entities.json.
+# The file is only loaded on the first lookup, so importing pikmingen stays cheap for
+# scripts that never need the names. The path is relative to this file and not to the
+# working directory. Running this file writes a marshal cache next to entities.json
+# which is used instead of the JSON file as long as it matches its size and modification time.
+
+import os
+
+from lib.cache_files import read_marshal, write_marshal
+
+ENTITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "entities.json")
+CACHE_EXTENSION = ".cache"
+CACHE_VERSION = 1
+
+_entities = None
+
+
+def get_cache_path(path):
+    return path + CACHE_EXTENSION
+
+
+def get_cache_key(stat):
+    return CACHE_VERSION, stat.st_size, stat.st_mtime_ns
+
+
+def read_json(path):
+    # json (and re, which it needs) take longer to import than the cache takes to load
+    import json
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_cache(path=ENTITIES_PATH):
+    stat = os.stat(path)
+    entities = read_json(path)
+
+    cache_path = get_cache_path(path)
+    write_marshal(cache_path, get_cache_key(stat), entities)
+
+    return cache_path
+
+
+def load_entities(path=ENTITIES_PATH, use_cache=True):
+    if use_cache:
+        entities = read_marshal(get_cache_path(path), get_cache_key(os.stat(path)))
+        if entities is not None:
+            return entities
+
+    return read_json(path)
+
+
+def get_entities():
+    global _entities
+
+    if _entities is None:
+        _entities = load_entities()
+
+    return _entities
+
+
+def get_table(name):
+    """Return the dictionary of names in entities.json, e.g. "teki", "treasures" or "expkit_treasures"."""
+    return get_entities()[name]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Write the cache of the entity names that is loaded instead of entities.json.")
+    parser.add_argument("path", nargs="?", default=ENTITIES_PATH,
+                        help="Entity JSON file. Default: {0}".format(ENTITIES_PATH))
+
+    args = parser.parse_args()
+
+    print("Written", write_cache(args.path))
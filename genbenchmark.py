@@ -0,0 +1,78 @@
+# Benchmark for copying generator objects.
+# Compares PikminObject.copy against deepcopy on the objects of real gen files and checks
+# that both copies are written out the same way and don't share any lists with the original, e.g.
+#   python genbenchmark.py path/to/initgen.txt path/to/defaultgen.txt
+
+from copy import deepcopy
+from io import StringIO
+
+from libpiktxt import PikminGenFile
+from lib.check_report import MismatchReport
+from lib.rarc_benchmark import measure
+
+
+def write_object(pikminobject):
+    genfile = PikminGenFile()
+    genfile.objects.append(pikminobject)
+    f = StringIO()
+    genfile.write(f)
+    return f.getvalue()
+
+
+def shares_lists(a, b):
+    # True if any list of the tree a is also part of the tree b
+    if isinstance(a, list):
+        if a is b:
+            return True
+        return any(shares_lists(x, y) for x, y in zip(a, b))
+    return False
+
+
+def check_copies(objects):
+    """Compare the copy of every object with its deepcopy, returns a MismatchReport."""
+    report = MismatchReport()
+
+    for pikminobject in objects:
+        copied = pikminobject.copy()
+        expected = deepcopy(pikminobject)
+
+        report.check(write_object(copied) == write_object(expected)
+                     and type(copied.arguments) is type(pikminobject.arguments)
+                     and copied.arguments is not pikminobject.arguments
+                     and not shares_lists(copied._object_data, pikminobject._object_data)
+                     and copied.get_rotation() == pikminobject.get_rotation()
+                     and copied.get_useful_object_name() == pikminobject.get_useful_object_name(),
+                     pikminobject.get_useful_object_name())
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time copying all objects of gen files with PikminObject.copy and deepcopy.")
+    parser.add_argument("files", nargs="+",
+                        help="Gen files whose objects are copied")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="How often the objects are copied, the fastest run is reported. Default: 5")
+
+    args = parser.parse_args()
+
+    objects = []
+    for path in args.files:
+        genfile = PikminGenFile()
+        genfile.from_path(path, use_cache=False)
+        objects.extend(genfile.objects)
+
+    report = check_copies(objects)
+
+    results = [
+        ("deepcopy", measure(lambda: [deepcopy(obj) for obj in objects], args.repeat)),
+        ("PikminObject.copy", measure(lambda: [obj.copy() for obj in objects], args.repeat))
+    ]
+    for name, result in results:
+        print("{0:20} {1:9.4f}s (median {2:.4f}s)".format(name, result["min"], result["median"]))
+    print("Speedup: {0:.1f}x".format(results[0][1]["min"] / results[1][1]["min"]))
+
+    report.exit("objects")
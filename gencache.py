@@ -0,0 +1,196 @@
+# Binary cache for parsed generator files.
+# The cache of a gen file is stored next to it (initgen.txt -> initgen.txt.gencache) and
+# remembers the size and modification time of the text file it was made from. As long as
+# those match, PikminGenFile.from_path loads the cache instead of parsing the text again.
+#
+# Format: see lib/cache_files.py, the key is made of the magic, format version, source size,
+# source mtime in nanoseconds and the encoding the text was decoded with. The value is the
+# file contents, TextNodes are stored as tuples and plain lists as lists so the nesting of
+# _object_data is kept.
+
+import os
+
+from array import array
+
+from pikmingen import PikminObject, TextNode
+from libpiktxt import PikminGenFile
+from lib.cache_files import read_marshal, write_marshal
+
+CACHE_MAGIC = b"PKGC"
+CACHE_VERSION = 2
+CACHE_EXTENSION = ".gencache"
+GEN_FILE_PATTERN = "gen.txt"
+DEFAULT_ENCODING = "shift_jis-2004"
+DEFAULT_ERRORS = "backslashreplace"
+
+
+def get_cache_path(path):
+    return path + CACHE_EXTENSION
+
+
+def get_cache_key(stat, encoding, errors):
+    # The same bytes give different text with another encoding or error handler
+    return CACHE_MAGIC, CACHE_VERSION, stat.st_size, stat.st_mtime_ns, encoding, errors
+
+
+def encode_tree(value):
+    if isinstance(value, TextNode):
+        return tuple(encode_tree(x) for x in value)
+    elif isinstance(value, list):
+        return [encode_tree(x) for x in value]
+    else:
+        return value
+
+
+def decode_tree(value):
+    if isinstance(value, tuple):
+        return TextNode(decode_tree(x) for x in value)
+    elif isinstance(value, list):
+        return [decode_tree(x) for x in value]
+    else:
+        return value
+
+
+def encode_object(pikminobject):
+    arguments = pikminobject.arguments
+    if isinstance(arguments, array):
+        arguments = arguments.tobytes()
+
+    return (pikminobject.version, pikminobject.reserved, pikminobject.days_till_resurrection, arguments,
+            (pikminobject.position_x, pikminobject.position_y, pikminobject.position_z),
+            (pikminobject.offset_x, pikminobject.offset_y, pikminobject.offset_z),
+            encode_tree(pikminobject.object_type), encode_tree(pikminobject.identifier_misc),
+            encode_tree(pikminobject._object_data), list(pikminobject.preceeding_comment))
+
+
+def decode_object(data):
+    (version, reserved, days_till_resurrection, arguments, position, offset,
+     object_type, identifier_misc, object_data, preceeding_comment) = data
+
+    pikminobject = PikminObject()
+    pikminobject.version = version
+    pikminobject.reserved = reserved
+    pikminobject.days_till_resurrection = days_till_resurrection
+    if isinstance(arguments, bytes):
+        pikminobject.arguments = array("B", arguments)
+    else:
+        pikminobject.arguments = list(arguments)
+
+    pikminobject.position_x, pikminobject.position_y, pikminobject.position_z = position
+    pikminobject.offset_x, pikminobject.offset_y, pikminobject.offset_z = offset
+    pikminobject.x = pikminobject.position_x + pikminobject.offset_x
+    pikminobject.y = pikminobject.position_y + pikminobject.offset_y
+    pikminobject.z = pikminobject.position_z + pikminobject.offset_z
+
+    pikminobject.object_type = decode_tree(object_type)
+    pikminobject.identifier_misc = decode_tree(identifier_misc)
+    pikminobject._object_data = decode_tree(object_data)
+    pikminobject.set_preceeding_comment(preceeding_comment)
+    pikminobject.update_rotation()
+    pikminobject.update_useful_name()
+
+    return pikminobject
+
+
+def write_cache(genfile, path, stat=None, encoding=DEFAULT_ENCODING, errors=DEFAULT_ERRORS):
+    """Write the cache for genfile, which was loaded from the text file at path with encoding."""
+    if stat is None:
+        stat = os.stat(path)
+
+    write_marshal(get_cache_path(path), get_cache_key(stat, encoding, errors),
+                  (genfile.version,
+                   (genfile.startpos_x, genfile.startpos_y, genfile.startpos_z),
+                   genfile.startdir,
+                   [encode_object(pikminobject) for pikminobject in genfile.objects]))
+
+
+def read_cache(genfile, path, stat=None, encoding=DEFAULT_ENCODING, errors=DEFAULT_ERRORS):
+    """Fill genfile from the cache of the text file at path.
+
+    Returns False if there is no cache or it doesn't match the current text file or
+    was made with a different encoding.
+    """
+    if stat is None:
+        stat = os.stat(path)
+
+    contents = read_marshal(get_cache_path(path), get_cache_key(stat, encoding, errors))
+    if contents is None:
+        return False
+
+    try:
+        genversion, startpos, startdir, objects = contents
+        objects = [decode_object(data) for data in objects]
+    except (EOFError, ValueError, TypeError, IndexError):
+        print("Ignoring invalid gen file cache for", path)
+        return False
+
+    genfile.version = genversion
+    genfile.startpos_x, genfile.startpos_y, genfile.startpos_z = startpos
+    genfile.startdir = startdir
+    genfile.objects = objects
+
+    return True
+
+
+def load_gen_file(genfile, path, encoding=DEFAULT_ENCODING, errors=DEFAULT_ERRORS):
+    """Load the text file at path into genfile, through the cache if it is up to date.
+
+    The cache is written if it was missing or outdated, failing to write it is not an error.
+    """
+    stat = os.stat(path)
+
+    if read_cache(genfile, path, stat, encoding, errors):
+        return True
+
+    with open(path, "r", encoding=encoding, errors=errors) as f:
+        genfile.from_file(f)
+
+    try:
+        write_cache(genfile, path, stat, encoding, errors)
+    except OSError as error:
+        print("Couldn't write gen file cache for", path, error)
+
+    return False
+
+
+def warm_cache(directory, pattern=GEN_FILE_PATTERN):
+    """Create or update the caches of all gen files in directory and its subdirectories.
+
+    Files are picked by their name ending with pattern. Returns the amount of files that
+    were parsed, were already cached and that failed.
+    """
+    parsed = cached = failed = 0
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if not filename.endswith(pattern):
+                continue
+
+            path = os.path.join(dirpath, filename)
+            try:
+                if load_gen_file(PikminGenFile(), path):
+                    cached += 1
+                else:
+                    parsed += 1
+                    print("Cached", path)
+            except Exception as error:
+                failed += 1
+                print("Failed to parse {0}: {1}".format(path, error))
+
+    return parsed, cached, failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Create the binary caches of all generator files in a directory, e.g. an extracted game.")
+    parser.add_argument("directory",
+                        help="Directory that is searched for gen files, including subdirectories")
+    parser.add_argument("--pattern", default=GEN_FILE_PATTERN,
+                        help="Files whose names end with this are cached. Default: {0}".format(GEN_FILE_PATTERN))
+
+    args = parser.parse_args()
+
+    parsed, cached, failed = warm_cache(args.directory, args.pattern)
+    print("Parsed {0} files, {1} were already cached, {2} failed".format(parsed, cached, failed))
@@ -0,0 +1,155 @@
+# Column store for the objects of a generator file.
+# ObjectColumns keeps NumPy arrays of the position, horizontal rotation, type and selection
+# state of every object in PikminGenFile.objects, in the same order. Selecting in a rectangle,
+# moving and grounding many objects then work on whole arrays instead of looping over the
+# objects in Python. The objects stay the actual data: every change made through the columns
+# is written back to them, and changes made to the objects directly have to be reported with
+# update() or PikminGenFile.invalidate_columns().
+#
+# NumPy is optional. Without it PikminGenFile.get_columns() returns None and the editor keeps
+# using its per-object loops.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import pikmingen
+
+TYPE_OTHER = 0
+TYPE_ITEM = 1
+TYPE_TEKI = 2
+TYPE_PELT = 3
+
+TYPE_CODES = {
+    "{item}": TYPE_ITEM,
+    "{teki}": TYPE_TEKI,
+    "{pelt}": TYPE_PELT
+}
+
+# Items that are lifted when grounded so they sit on the ground instead of in it
+GROUND_OFFSETS = {
+    pikmingen.KIND_SMALL_BLOCK: 45.0,
+    pikmingen.KIND_NORMAL_BLOCK: 45.0,
+    pikmingen.KIND_PAPER_BAG: 45.0
+}
+
+
+def is_available():
+    return numpy is not None
+
+
+def get_ground_offset(pikminobject):
+    return GROUND_OFFSETS.get(pikminobject.get_kind(), 0.0)
+
+
+def get_rotation_value(pikminobject):
+    # Objects without a rotation are stored as NaN
+    angle = pikminobject.get_horizontal_rotation()
+    return float("nan") if angle is None else angle
+
+
+class ObjectColumns(object):
+    def __init__(self, objects):
+        self.objects = objects
+        count = len(objects)
+
+        self.x = numpy.fromiter((obj.x for obj in objects), numpy.float64, count)
+        self.y = numpy.fromiter((obj.y for obj in objects), numpy.float64, count)
+        self.z = numpy.fromiter((obj.z for obj in objects), numpy.float64, count)
+        self.rotation = numpy.fromiter((get_rotation_value(obj) for obj in objects), numpy.float64, count)
+        self.type_code = numpy.fromiter((TYPE_CODES.get(obj.object_type, TYPE_OTHER) for obj in objects),
+                                        numpy.int8, count)
+        self.ground_offset = numpy.fromiter((get_ground_offset(obj) for obj in objects), numpy.float64, count)
+        self.selected = numpy.zeros(count, dtype=bool)
+
+        self._indices = {obj: i for i, obj in enumerate(objects)}
+
+    def __len__(self):
+        return len(self.x)
+
+    def is_current(self, objects):
+        # Adding or removing objects changes the length, replacing the list changes its identity
+        return objects is self.objects and len(objects) == len(self.x)
+
+    def indices(self, objects):
+        return numpy.fromiter((self._indices[obj] for obj in objects), numpy.intp, len(objects))
+
+    def update(self, objects):
+        """Read the position and rotation of objects again after they were changed directly."""
+        for obj in objects:
+            i = self._indices[obj]
+            self.x[i] = obj.x
+            self.y[i] = obj.y
+            self.z[i] = obj.z
+            self.rotation[i] = get_rotation_value(obj)
+
+    def set_selection(self, objects):
+        # Objects that aren't in the file (anymore) are ignored
+        indices = self._indices
+        self.selected[:] = False
+        self.selected[[indices[obj] for obj in objects if obj in indices]] = True
+
+    def in_rectangle(self, startx, startz, endx, endz):
+        """Return the objects inside the rectangle in the top down view, which shows -z on
+        the vertical axis. The objects keep their order in the file."""
+        mask = (startx <= self.x) & (self.x <= endx) & (startz <= -self.z) & (-self.z <= endz)
+        objects = self.objects
+        return [objects[i] for i in numpy.flatnonzero(mask).tolist()]
+
+    def move(self, objects, deltax, deltaz):
+        """Move objects horizontally. The offsets are merged into the position like
+        the editor did before, coordinates are rounded to 6 decimals."""
+        if len(objects) == 0:
+            return
+
+        indices = self.indices(objects)
+        # Python's round is used so the values are exactly the ones written before
+        newx = [round(x, 6) for x in (self.x[indices] + deltax).tolist()]
+        newz = [round(z, 6) for z in (self.z[indices] + deltaz).tolist()]
+        self.x[indices] = newx
+        self.z[indices] = newz
+
+        for obj, x, z in zip(objects, newx, newz):
+            obj.position_x = obj.x = x
+            obj.position_z = obj.z = z
+            obj.offset_x = 0
+            obj.offset_z = 0
+
+    def change_heights(self, objects, deltay):
+        if len(objects) == 0:
+            return
+
+        indices = self.indices(objects)
+        newy = [round(y, 6) for y in (self.y[indices] + deltay).tolist()]
+        self.y[indices] = newy
+
+        for obj, y in zip(objects, newy):
+            obj.position_y = obj.y = y
+            obj.offset_y = 0
+
+    def ground(self, objects, collision):
+        """Put objects on the ground of collision, blocks and paper bags are lifted by
+        their GROUND_OFFSETS. Objects without ground below them keep their height.
+        Returns the amount of objects that were moved."""
+        if len(objects) == 0:
+            return 0
+
+        indices = self.indices(objects)
+        heights = numpy.fromiter(
+            (numpy.nan if height is None else height
+             for height in map(collision.collide_ray_downwards, self.x[indices].tolist(), self.z[indices].tolist())),
+            numpy.float64, len(indices))
+
+        heights += self.ground_offset[indices]
+
+        hit = numpy.flatnonzero(~numpy.isnan(heights)).tolist()
+        newy = [round(y, 6) for y in heights[hit].tolist()]
+        self.y[indices[hit]] = newy
+
+        for i, y in zip(hit, newy):
+            obj = objects[i]
+            obj.position_y = obj.y = y
+            obj.offset_y = 0.0
+
+        return len(hit)
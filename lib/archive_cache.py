@@ -0,0 +1,102 @@
+## On-disk cache for decompressed Yaz0 archives.
+## Entries are keyed by the SHA-1 of the compressed file so loading the same texts.szs
+## again (from either editor) becomes a plain file read. The total size of the cache is
+## capped, the least recently used entries are removed first.
+
+import os
+import hashlib
+import zlib
+from struct import pack, unpack
+
+from .cache_files import write_atomic
+
+CACHE_MAGIC = b"PKAC"
+CACHE_VERSION = 1
+HEADER_SIZE = 16
+DEFAULT_MAX_SIZE = 256*1024*1024
+# cache/archives next to the editors, independent of the working directory they are started from
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "archives")
+
+
+class ArchiveCache(object):
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + ".bin")
+
+    def get(self, key):
+        """Return the cached data for key, or None if there is no valid entry."""
+        entry_path = self._entry_path(key)
+
+        try:
+            with open(entry_path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(header) != HEADER_SIZE:
+            self._remove(entry_path)
+            return None
+
+        magic, version, size, checksum = unpack(">4sIII", header)
+        if (magic != CACHE_MAGIC or version != CACHE_VERSION
+                or size != len(data) or checksum != zlib.crc32(data)):
+            print("Removing invalid archive cache entry", entry_path)
+            self._remove(entry_path)
+            return None
+
+        # The modification time is used for finding the least recently used entries
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.path, exist_ok=True)
+
+        write_atomic(self._entry_path(key),
+                     pack(">4sIII", CACHE_MAGIC, CACHE_VERSION, len(data), zlib.crc32(data)), data)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(".bin"):
+                # Entries can be removed by another editor in the meantime
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(entry_path)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.is_file() and entry.name.endswith(".bin"):
+                    self._remove(entry.path)
+
+    def _remove(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
@@ -0,0 +1,213 @@
+## Batch mode for packing/extracting RARC archives and Yaz0 compressing/decompressing files.
+## Every input is handled in its own worker process so a full project rebuild scales with the
+## amount of CPU cores. Inputs can be paths or glob patterns, e.g.
+##   python -m lib.batch extract "user/Kando/map/*/texts.szs"
+##   python -m lib.batch pack --yaz0 --workers 8 "build/*/texts_ext"
+
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit import default_timer as time
+
+from . import rarc
+from .yaz0 import compress, decompress_buffer, DEFAULT_LEVEL, COMPRESSION_LEVELS
+
+MODES = ("auto", "pack", "extract", "compress", "decompress")
+
+
+def expand_inputs(patterns):
+    # Globs are expanded, plain paths are kept as they are so missing files are reported as failures
+    inputs = []
+    seen = set()
+
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+
+        for path in matches:
+            path = os.path.normpath(path)
+            if path not in seen:
+                seen.add(path)
+                inputs.append(path)
+
+    return inputs
+
+
+def get_output_path(mode, inputpath, yaz0=False):
+    if mode == "compress":
+        return inputpath + ".szs"
+    elif mode == "decompress":
+        if inputpath.endswith(".szs"):
+            return inputpath[:-4] + ".arc"
+        else:
+            return inputpath + ".dec"
+    else:
+        return rarc.get_output_path(inputpath, yaz0)
+
+
+def get_output_paths(mode, inputs, yaz0=False, output_dir=None):
+    """Return the output path of every input, in the order of inputs.
+
+    With output_dir the outputs keep their path relative to the common directory of all
+    inputs, so a/texts.szs and b/texts.szs don't end up in the same place. Raises a
+    RuntimeError if two inputs would still be written to the same output.
+    """
+    outputs = [get_output_path(mode, inputpath, yaz0) for inputpath in inputs]
+
+    if output_dir is not None and outputs:
+        try:
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(inputpath)) for inputpath in inputs])
+        except ValueError:
+            raise RuntimeError("Inputs on different drives can't be written to one output directory")
+
+        outputs = [os.path.join(output_dir, os.path.relpath(os.path.abspath(outputpath), root))
+                   for outputpath in outputs]
+
+    seen = {}
+    for inputpath, outputpath in zip(inputs, outputs):
+        key = os.path.normcase(os.path.abspath(outputpath))
+        if key in seen:
+            raise RuntimeError("{0} and {1} would both be written to {2}".format(seen[key], inputpath, outputpath))
+        seen[key] = inputpath
+
+    return outputs
+
+
+def get_size(path):
+    if os.path.isdir(path):
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+        return size
+    else:
+        return os.path.getsize(path)
+
+
+def run_job(mode, inputpath, outputpath, yaz0=False, level=DEFAULT_LEVEL):
+    # Runs in a worker process. Returns (seconds, input size, output size)
+    start = time()
+
+    if mode == "auto":
+        mode = "pack" if os.path.isdir(inputpath) else "extract"
+
+    if mode == "pack":
+        rarc.pack_dir(inputpath, outputpath, yaz0=yaz0, level=level)
+    elif mode == "extract":
+        rarc.extract_archive(inputpath, outputpath)
+    elif mode == "compress":
+        with open(inputpath, "rb") as f:
+            with open(outputpath, "wb") as g:
+                compress(f, g, level)
+    elif mode == "decompress":
+        with open(inputpath, "rb") as f:
+            data = decompress_buffer(f.read())
+        with open(outputpath, "wb") as g:
+            g.write(data)
+    else:
+        raise RuntimeError("Unknown mode: {0}".format(mode))
+
+    return time() - start, get_size(inputpath), get_size(outputpath)
+
+
+def run_batch(mode, inputs, workers=None, yaz0=False, level=DEFAULT_LEVEL, output_dir=None):
+    """Process all inputs with a pool of worker processes.
+
+    Returns a list of (input path, output path, seconds, input size, output size, error)
+    tuples in the order of inputs. error is None for files that were processed successfully.
+    """
+    # All outputs are known before any work starts so clashing outputs fail the whole batch
+    jobs = list(zip(inputs, get_output_paths(mode, inputs, yaz0, output_dir)))
+
+    if output_dir is not None:
+        for inputpath, outputpath in jobs:
+            os.makedirs(os.path.dirname(outputpath), exist_ok=True)
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for inputpath, outputpath in jobs:
+            future = executor.submit(run_job, mode, inputpath, outputpath, yaz0, level)
+            futures[future] = (inputpath, outputpath)
+
+        for future in as_completed(futures):
+            inputpath, outputpath = futures[future]
+
+            try:
+                seconds, insize, outsize = future.result()
+            except Exception as e:
+                result = (inputpath, outputpath, 0.0, 0, 0, "{0}: {1}".format(type(e).__name__, e))
+                print("FAILED {0}: {1}".format(inputpath, result[5]))
+            else:
+                result = (inputpath, outputpath, seconds, insize, outsize, None)
+                print("{0:8.3f}s {1} -> {2}".format(seconds, inputpath, outputpath))
+
+            results[inputpath] = result
+
+    return [results[inputpath] for inputpath, outputpath in jobs]
+
+
+def print_summary(results, wall_time):
+    failed = [result for result in results if result[5] is not None]
+    cpu_time = sum(result[2] for result in results)
+    insize = sum(result[3] for result in results)
+    outsize = sum(result[4] for result in results)
+
+    print("")
+    print("Processed {0} files, {1} failed".format(len(results), len(failed)))
+    print("Input: {0} bytes, output: {1} bytes".format(insize, outsize))
+    print("Wall time: {0:.3f}s, summed time per file: {1:.3f}s".format(wall_time, cpu_time))
+    if wall_time > 0:
+        print("Speedup from parallelism: {0:.2f}x".format(cpu_time / wall_time))
+
+    if results:
+        slowest = max(results, key=lambda result: result[2])
+        print("Slowest: {0} ({1:.3f}s)".format(slowest[0], slowest[2]))
+
+    for result in failed:
+        print("Failed: {0}: {1}".format(result[0], result[5]))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Pack, extract, compress or decompress many files at once using multiple processes.")
+    parser.add_argument("mode", choices=MODES,
+                        help="auto packs directories and extracts files, like rarc.py does for a single input.")
+    parser.add_argument("inputs", nargs="+",
+                        help="Input files/directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Amount of worker processes. Default: amount of CPU cores")
+    parser.add_argument("--yaz0", action="store_true",
+                        help="Compress archives with yaz0 when packing")
+    parser.add_argument("--level", type=int, default=DEFAULT_LEVEL, choices=sorted(COMPRESSION_LEVELS.keys()),
+                        help="Yaz0 compression level. Default: {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--output_dir", default=None,
+                        help="Write all outputs to this directory instead of next to the inputs")
+
+    args = parser.parse_args()
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("No inputs found")
+        sys.exit(1)
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time()
+    try:
+        results = run_batch(args.mode, inputs, workers=args.workers, yaz0=args.yaz0, level=args.level,
+                            output_dir=args.output_dir)
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
+    print_summary(results, time() - start)
+
+    if any(result[5] is not None for result in results):
+        sys.exit(1)
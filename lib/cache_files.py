@@ -0,0 +1,45 @@
+## Helpers for the cache files written next to or on behalf of game files
+## (archive_cache.py, gencache.py and entities.py).
+## write_atomic replaces files through a temporary file so a reader never sees a partially
+## written cache. read_marshal/write_marshal store a key before the marshalled value: the
+## value is only loaded if the key matches, e.g. the size and modification time of the file
+## the cache was made from.
+
+import os
+import sys
+import marshal
+
+# marshal's format can change between Python versions, so it is part of every key
+MARSHAL_VERSION = (sys.version_info[0] << 8) | sys.version_info[1]
+
+
+def write_atomic(path, *chunks):
+    temp_path = path + ".{0}.tmp".format(os.getpid())
+
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_marshal(path, key, value):
+    write_atomic(path, marshal.dumps((MARSHAL_VERSION, key)), marshal.dumps(value))
+
+
+def read_marshal(path, key):
+    """Return the value stored at path with write_marshal, or None if the file is missing,
+    invalid or was written with a different key or Python version."""
+    try:
+        with open(path, "rb") as f:
+            if marshal.load(f) != (MARSHAL_VERSION, key):
+                return None
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
@@ -0,0 +1,24 @@
+## Shared reporting for the --check modes that compare two implementations against each
+## other (lib/yaz0_native.py, libpiktxt.py, genbenchmark.py).
+
+import sys
+
+
+class MismatchReport(object):
+    def __init__(self):
+        self.checked = 0
+        self.mismatches = 0
+
+    def check(self, ok, description):
+        """Count a checked case, cases that aren't ok are printed. Returns ok."""
+        self.checked += 1
+        if not ok:
+            self.mismatches += 1
+            print("MISMATCH:", description)
+
+        return ok
+
+    def exit(self, what="inputs"):
+        """Print the totals and exit with status 1 if there were mismatches."""
+        print("Checked {0} {1}, {2} mismatches".format(self.checked, what, self.mismatches))
+        sys.exit(1 if self.mismatches else 0)
@@ -1,7 +1,14 @@
-from struct import pack, unpack
+import os
+import mmap
+from struct import pack, unpack_from
 from io import BytesIO
 from itertools import chain
-from .yaz0 import decompress, compress_fast, read_uint32, read_uint16
+from fnmatch import translate
+import re
+from collections import deque
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from .yaz0 import decompress_buffer, compress_fast, Yaz0Writer, find_group_starts, WINDOW_SIZE, read_uint32, read_uint16, COMPRESSION_LEVELS, DEFAULT_LEVEL
 
 import time
 
@@ -20,6 +27,34 @@ def write_pad32(f):
 
 DATA = [0]
 
+# ArchiveCache used by Archive.from_file for Yaz0 compressed archives, see set_archive_cache
+_archive_cache = None
+
+
+def set_archive_cache(cache):
+    global _archive_cache
+    _archive_cache = cache
+
+
+def decompress_cached(data):
+    if _archive_cache is None:
+        return decompress_buffer(data)
+
+    key = _archive_cache.key(data)
+    decompressed = _archive_cache.get(key)
+
+    if decompressed is None:
+        decompressed = decompress_buffer(data)
+        # The cache only makes loading faster, an archive can still be opened without it
+        try:
+            _archive_cache.put(key, decompressed)
+        except OSError as error:
+            print("Couldn't write archive cache entry", key, error)
+    else:
+        print("Loaded decompressed archive from cache")
+
+    return decompressed
+
 # Hashing algorithm taken from Gamma and LordNed's WArchive-Tools, hope it works
 def hash_name(name):
     hash = 0
@@ -57,26 +92,48 @@ class StringTable(object):
     def write_to(self, f):
         f.write(self._strings.getvalue())
 
-def stringtable_get_name(f, stringtable_offset, offset):
-    current = f.tell()
-    f.seek(stringtable_offset+offset)
+class StringTableReader(object):
+    """All names of an archive's string table, read in one go.
 
-    stringlen = 0
-    while f.read(1) != b"\x00":
-        stringlen += 1
+    Names are split at their NUL terminators once and only decoded from
+    Shift-JIS when they are looked up for the first time.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._raw = {}
+        self._names = {}
 
-    f.seek(stringtable_offset+offset)
+        start = 0
+        for raw in data.split(b"\x00"):
+            self._raw[start] = raw
+            start += len(raw) + 1
 
-    filename = f.read(stringlen)
-    try:
-        decodedfilename = filename.decode("shift-jis")
-    except:
-        print("filename", filename)
-        print("failed")
-        raise
-    f.seek(current)
+    @classmethod
+    def from_file(cls, f, stringtable_offset, size):
+        f.seek(stringtable_offset)
+        return cls(f.read(size))
+
+    def get_name(self, offset):
+        name = self._names.get(offset)
+
+        if name is None:
+            raw = self._raw.get(offset)
+            if raw is None:
+                # Names can in theory start in the middle of another name
+                end = self._data.find(b"\x00", offset)
+                raw = self._data[offset:] if end == -1 else self._data[offset:end]
+
+            try:
+                name = raw.decode("shift-jis")
+            except:
+                print("filename", raw)
+                print("failed")
+                raise
+
+            self._names[offset] = name
+
+        return name
 
-    return decodedfilename
 
 def split_path(path): # Splits path at first backslash encountered
     for i, char in enumerate(path):
@@ -88,6 +145,11 @@ def split_path(path): # Splits path at first backslash encountered
 
     return path, None
 
+
+def normalize_path(path):
+    # Key used by the path index of archives. Like the game, paths are case insensitive
+    return "/".join(part for part in path.replace("\\", "/").split("/") if part).lower()
+
 class Directory(object):
     def __init__(self, dirname, nodeindex=None):
         self.files = {}
@@ -98,7 +160,8 @@ class Directory(object):
         self.parent = None
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
+    def from_dir(cls, path, follow_symlinks=False, lazy=False):
+        # With lazy=True only the sizes of the files are recorded, they are read when they are needed
         dirname = os.path.basename(path)
         #print(dirname, path)
         dir = cls(dirname)
@@ -107,12 +170,15 @@ class Directory(object):
         for entry in os.scandir(path):
             #print(entry.path, dirname)
             if entry.is_dir(follow_symlinks=follow_symlinks):
-                newdir = Directory.from_dir(entry.path, follow_symlinks=follow_symlinks)
+                newdir = Directory.from_dir(entry.path, follow_symlinks=follow_symlinks, lazy=lazy)
                 dir.subdirs[entry.name] = newdir
 
             elif entry.is_file(follow_symlinks=follow_symlinks):
-                with open(entry.path, "rb") as f:
-                    file = File.from_file(entry.name, f)
+                if lazy:
+                    file = DiskFile(entry.name, entry.path, entry.stat(follow_symlinks=follow_symlinks).st_size)
+                else:
+                    with open(entry.path, "rb") as f:
+                        file = File.from_file(entry.name, f)
                 dir.files[entry.name] = file
 
         return dir
@@ -120,7 +186,9 @@ class Directory(object):
 
 
     @classmethod
-    def from_node(cls, f, _name, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None):
+    def from_node(cls, f, _name, stringtable, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None,
+                  buffer=None):
+        # If buffer is set, files aren't read from f but reference their data in buffer until they are accessed.
         #print("=============================")
         #print("Creating new node with index", currentnodeindex)
         name, unknown, entrycount, entryoffset = nodelist[currentnodeindex]
@@ -129,19 +197,19 @@ class Directory(object):
 
         newdir = cls(name, currentnodeindex)
 
-        firstentry = globalentryoffset+entryoffset
+        firstentry = globalentryoffset+entryoffset*20
         #print("Node", currentnodeindex, name, entrycount, entryoffset)
         #print("offset", f.tell())
-        for i in range(entrycount):
-            offset = globalentryoffset + (entryoffset+i)*20
-            f.seek(offset)
 
-            fileentry_data = f.read(20)
+        # Read all entries of this directory at once
+        f.seek(firstentry)
+        entries_data = f.read(entrycount*20)
 
-            fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack(">HHBBHIII", fileentry_data)
+        for i in range(entrycount):
+            fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack_from(">HHBBHIII", entries_data, i*20)
             #print("offset", hex(firstentry+i*20), fileid, flags, nameoffset)
 
-            name = stringtable_get_name(f, stringtable_offset, nameoffset)
+            name = stringtable.get_name(nameoffset)
 
             #print("name", name, fileid)
 
@@ -154,7 +222,6 @@ class Directory(object):
                 #nodeindex, datasize, padding = unpack(">III", fileentrydata)
                 nodeindex = filedataoffset
 
-                name = stringtable_get_name(f, stringtable_offset, nameoffset)
                 #print(name, hashcode, hash_name(name))
 
 
@@ -168,15 +235,19 @@ class Directory(object):
                     print("Skipping")
                     continue
 
-                subdir = Directory.from_node(f, name, stringtable_offset, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents)
+                subdir = Directory.from_node(f, name, stringtable, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents,
+                                             buffer=buffer)
                 subdir.parent = newdir
 
                 newdir.subdirs[subdir.name] = subdir
 
 
             else: # entry is a file
-                f.seek(offset)
-                file = File.from_fileentry(f, stringtable_offset, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
+                if buffer is not None:
+                    file = LazyFile.from_fileentry(f, stringtable, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize,
+                                                   buffer)
+                else:
+                    file = File.from_fileentry(f, stringtable, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
                 newdir.files[file.name] = file
 
         return newdir
@@ -195,6 +266,13 @@ class Directory(object):
             #print("yielding subdir", dirname)
             yield from dir.walk(dirpath)
 
+    def iter_dirs(self):
+        # Same order as walk()
+        yield self
+
+        for dirname, dir in self.subdirs.items():
+            yield from dir.iter_dirs()
+
     def __getitem__(self, path):
         name, rest = split_path(path)
 
@@ -214,15 +292,16 @@ class Directory(object):
         name, rest = split_path(path)
 
         if rest is None or rest.strip() == "":
-            if isinstance(name, File):
+            if isinstance(entry, File):
                 if name in self.subdirs:
                     raise FileExistsError("Cannot add file, '{}' already exists as a directory".format(path))
 
                 self.files[name] = entry
-            elif isinstance(name, Directory):
+            elif isinstance(entry, Directory):
                 if name in self.files:
                     raise FileExistsError("Cannot add directory, '{}' already exists as a file".format(path))
 
+                entry.parent = self
                 self.subdirs[name] = entry
             else:
                 raise TypeError("Entry should be of type File or Directory but is type {}".format(type(entry)))
@@ -230,7 +309,7 @@ class Directory(object):
         elif name in self.files:
             raise RuntimeError("File", name, "is a directory in path", path, "which should not happen!")
         else:
-            return self.subdirs[name][rest]
+            self.subdirs[name][rest] = entry
 
     def listdir(self, path):
         if path == ".":
@@ -276,12 +355,12 @@ class File(BytesIO):
 
 
     @classmethod
-    def from_fileentry(cls, f, stringtable_offset, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
-        filename = stringtable_get_name(f, stringtable_offset, nameoffset)
+    def from_fileentry(cls, f, stringtable, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
+        filename = stringtable.get_name(nameoffset)
         """print("-----")
         print("File", len(filename))
         print("size", datasize)
-        print(hex(stringtable_offset), hex(nameoffset))
+        print(hex(nameoffset))
         print(hex(datasize))"""
         file = cls(filename, fileid, hashcode, flags)
 
@@ -296,41 +375,354 @@ class File(BytesIO):
     def dump(self, f):
         f.write(self.getvalue())
 
+    def size(self):
+        return len(self.getbuffer())
+
+    def view(self):
+        # Resizing the file isn't possible while the returned memoryview is in use
+        return self.getbuffer()
+
+
+class LazyFile(File):
+    """File whose data stays in the archive's buffer until the file is accessed for the first time."""
+    def __init__(self, filename, buffer, offset, size, fileid=None, hashcode=None, flags=None):
+        super().__init__(filename, fileid, hashcode, flags)
+
+        self._buffer = buffer
+        self._offset = offset
+        self._size = size
+
+    @classmethod
+    def from_fileentry(cls, f, stringtable, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize,
+                       buffer):
+        filename = stringtable.get_name(nameoffset)
+
+        return cls(filename, buffer, globaldataoffset+filedataoffset, datasize, fileid, hashcode, flags)
+
+    def is_loaded(self):
+        return self._buffer is None
+
+    def load(self):
+        if self._buffer is not None:
+            BytesIO.write(self, self._buffer[self._offset:self._offset+self._size])
+            BytesIO.seek(self, 0)
+            self._buffer = None
+
+    def dump(self, f):
+        if self._buffer is not None:
+            f.write(self._buffer[self._offset:self._offset+self._size])
+        else:
+            super().dump(f)
+
+    def size(self):
+        if self._buffer is not None:
+            return self._size
+        else:
+            return super().size()
+
+    def view(self):
+        if self._buffer is not None:
+            return self._buffer[self._offset:self._offset+self._size]
+        else:
+            return super().view()
+
+
+class DiskFile(File):
+    """File that is read from disk when it is accessed for the first time."""
+    def __init__(self, filename, path, size, fileid=None, hashcode=None, flags=None):
+        super().__init__(filename, fileid, hashcode, flags)
+
+        self._path = path
+        self._size = size
+
+    def is_loaded(self):
+        return self._path is None
+
+    def read_data(self):
+        # Can be called from worker threads, doesn't change the file
+        with open(self._path, "rb") as f:
+            data = f.read()
+
+        if len(data) != self._size:
+            raise RuntimeError("File {0} changed size from {1} to {2} bytes while packing".format(
+                self._path, self._size, len(data)))
+
+        return data
+
+    def load(self):
+        if self._path is not None:
+            BytesIO.write(self, self.read_data())
+            BytesIO.seek(self, 0)
+            self._path = None
+
+    def dump(self, f):
+        if self._path is not None:
+            f.write(self.read_data())
+        else:
+            super().dump(f)
+
+    def size(self):
+        if self._path is not None:
+            return self._size
+        else:
+            return super().size()
+
+    def view(self):
+        if self._path is not None:
+            return memoryview(self.read_data())
+        else:
+            return super().view()
+
+
+def _load_first(name):
+    method = getattr(BytesIO, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ("read", "read1", "readinto", "readinto1", "readline", "readlines", "__iter__", "__next__",
+              "seek", "tell", "write", "writelines", "truncate", "getvalue", "getbuffer"):
+    setattr(LazyFile, _name, _load_first(_name))
+    setattr(DiskFile, _name, _load_first(_name))
+
+
+def iter_file_data(files, workers=None):
+    """Yield the data of each file in files, in order.
+
+    Files that still have to be read from disk are read ahead by a pool of threads,
+    with at most twice the amount of workers reads in flight.
+    """
+    if not any(isinstance(file, DiskFile) and not file.is_loaded() for file in files):
+        for file in files:
+            yield file.view()
+        return
+
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(file):
+            if isinstance(file, DiskFile) and not file.is_loaded():
+                return file, executor.submit(file.read_data)
+            else:
+                return file, None
+
+        remaining = iter(files)
+        pending = deque(submit(file) for i, file in zip(range(workers*2), remaining))
+
+        while pending:
+            file, future = pending.popleft()
+            for nextfile in remaining:
+                pending.append(submit(nextfile))
+                break
+
+            if future is None:
+                yield file.view()
+            else:
+                yield future.result()
+
+
+def common_prefix_length(a, b, chunk_size=0x1000):
+    a = memoryview(a).cast("B")
+    b = memoryview(b).cast("B")
+    size = min(len(a), len(b))
+
+    for start in range(0, size, chunk_size):
+        end = min(start+chunk_size, size)
+        if a[start:end] != b[start:end]:
+            for i in range(start, end):
+                if a[i] != b[i]:
+                    return i
+
+    return size
+
+
+class _SpliceWriter(object):
+    # Passes everything written to a Yaz0Writer, except for the parts in splices which
+    # are copied as already compressed data with Yaz0Writer.splice instead.
+    # splices are (start, end, compressed, data) sorted by start.
+    def __init__(self, out, splices):
+        self._out = out
+        self._splices = deque(splices)
+        self._pos = 0
+
+    def write(self, data):
+        data = memoryview(data)
+
+        while len(data) > 0:
+            if len(self._splices) == 0:
+                self._out.write(data)
+                self._pos += len(data)
+                return
+
+            start, end, compressed, spliced = self._splices[0]
+
+            if self._pos < start:
+                count = min(len(data), start - self._pos)
+                self._out.write(data[:count])
+            else:
+                if self._pos == start:
+                    self._out.splice(compressed, spliced)
+
+                count = min(len(data), end - self._pos)
+                if self._pos + count == end:
+                    self._splices.popleft()
+
+            data = data[count:]
+            self._pos += count
+
+
+class BufferReader(object):
+    """Minimal seekable reader over a bytes-like object that doesn't copy it."""
+    def __init__(self, buffer):
+        if isinstance(buffer, memoryview):
+            self.buffer = buffer
+        else:
+            self.buffer = memoryview(buffer)
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self.buffer)
+        else:
+            end = self._pos + size
+
+        data = self.buffer[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = len(self.buffer) + offset
+
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
 
 class Archive(object):
     def __init__(self):
-        self.root = None
+        # Normalized path -> (path, entry) for the root and everything in it, see normalize_path
+        self._index = {}
+        self._root = None
+
+        # Set for archives opened with open_mmap
+        self._mmap = None
+        self._mapped_file = None
+        self._buffer = None
+
+        # Decompressed and compressed data of lazily loaded archives, used by write_arc_update
+        self._source = None
+        self._source_compressed = None
+
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, dir):
+        self._root = dir
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """Index all entries again. Only needed after changing Directory.files or
+        Directory.subdirs directly, Archive.__setitem__ keeps the index up to date."""
+        self._index = {}
+        if self._root is not None:
+            self._index_add(self._root.name, self._root)
+
+    def _index_add(self, path, entry):
+        self._index[normalize_path(path)] = (path, entry)
+
+        if isinstance(entry, Directory):
+            for name, file in entry.files.items():
+                self._index[normalize_path(path + "/" + name)] = (path + "/" + name, file)
+            for name, dir in entry.subdirs.items():
+                self._index_add(path + "/" + name, dir)
+
+    def _index_remove(self, key):
+        if key in self._index:
+            path, entry = self._index.pop(key)
+
+            if isinstance(entry, Directory):
+                prefix = key + "/"
+                for subkey in [subkey for subkey in self._index if subkey.startswith(prefix)]:
+                    del self._index[subkey]
+
+    def find(self, path):
+        """Return the file or directory at path (case insensitive) or None if it doesn't exist."""
+        result = self._index.get(normalize_path(path))
+        if result is None:
+            return None
+        else:
+            return result[1]
+
+    def glob(self, pattern):
+        """Return a list of (path, entry) for all entries whose path matches pattern.
+
+        Patterns use fnmatch syntax and are case insensitive, * also matches slashes.
+        Paths start with the root directory, e.g. "text/*.bin".
+        """
+        regex = re.compile(translate(normalize_path(pattern)))
+        return [result for key, result in self._index.items() if regex.match(key)]
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
+    def from_dir(cls, path, follow_symlinks=False, lazy=False):
         arc = cls()
-        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks)
+        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks, lazy=lazy)
         arc.root = dir
 
         return arc
 
 
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, lazy=False):
+        """Read an archive (optionally Yaz0 compressed) from f.
+
+        With lazy=True only the directory structure is parsed. File data stays in a
+        buffer shared by all files and is copied out when a file is first accessed.
+        """
         newarc = cls()
         print("ok")
         header = f.read(4)
+        buffer = None
 
         if header == b"Yaz0":
             # Decompress first
             print("Yaz0 header detected, decompressing...")
             start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
             f.seek(0)
+            compressed = f.read()
+            decompressed = decompress_cached(compressed)
+            if lazy:
+                buffer = decompressed
+                f = BufferReader(buffer)
+                newarc._source_compressed = compressed
+            else:
+                f = BytesIO(decompressed)
 
             header = f.read(4)
             print("Finished decompression.")
             print("Time taken:", time.time() - start)
+        elif lazy:
+            f.seek(0)
+            if isinstance(f, BufferReader):
+                buffer = f.buffer
+            else:
+                buffer = f.read()
+                f = BufferReader(buffer)
+            header = f.read(4)
 
         if header == b"RARC":
             pass
@@ -345,34 +737,100 @@ class Archive(object):
         node_count = read_uint32(f)
         f.read(8) # Unknown
         file_entry_offset = read_uint32(f) + 0x20
-        f.read(4) # Unknown
+        stringtable_size = read_uint32(f)
         stringtable_offset = read_uint32(f) + 0x20
         f.read(8) # Unknown
         nodes = []
 
         print("Archive has", node_count, " total directories")
 
-                
-        
+        nodes_data = f.read(node_count*16)
+
+        if stringtable_size == 0:
+            stringtable_size = data_offset - stringtable_offset
+        stringtable = StringTableReader.from_file(f, stringtable_offset, stringtable_size)
+
         #print("data offset", hex(data_offset))
         for i in range(node_count):
-            nodetype = f.read(4)
-            nodedata = f.read(4+2+2+4)
-            nameoffset, unknown, entrycount, entryoffset = unpack(">IHHI", nodedata)
+            nodetype, nameoffset, unknown, entrycount, entryoffset = unpack_from(">4sIHHI", nodes_data, i*16)
 
             if i == 0:
-                dir_name = stringtable_get_name(f, stringtable_offset, nameoffset)
+                dir_name = stringtable.get_name(nameoffset)
             else:
                 dir_name = None 
                 
             nodes.append((dir_name, unknown, entrycount, entryoffset))
 
         rootfoldername = nodes[0][0]
-        newarc.root = Directory.from_node(f, rootfoldername, stringtable_offset, file_entry_offset, data_offset, nodes, 0)
+        newarc.root = Directory.from_node(f, rootfoldername, stringtable, file_entry_offset, data_offset, nodes, 0,
+                                          buffer=buffer)
+        newarc._source = buffer
 
         return newarc
 
 
+    @classmethod
+    def open_mmap(cls, path):
+        """Open an uncompressed archive by memory mapping it.
+
+        Files are lazy and File.view() returns memoryviews into the mapping, extraction
+        writes straight from it. The archive and all views of its files are only valid
+        until close() is called, which is done automatically when used as a context manager.
+        Views have to be released (or deleted) before that, otherwise close() raises a
+        BufferError. The file is closed in any case and the mapping is freed once the last
+        view is gone.
+        """
+        mapped_file = open(path, "rb")
+        try:
+            mapped = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            mapped_file.close()
+            raise
+
+        buffer = memoryview(mapped)
+
+        try:
+            if buffer[:4] == b"Yaz0":
+                raise RuntimeError("Yaz0 compressed archives can't be memory mapped, use Archive.from_file instead")
+
+            arc = cls.from_file(BufferReader(buffer), lazy=True)
+        except:
+            buffer.release()
+            mapped.close()
+            mapped_file.close()
+            raise
+
+        arc._mmap = mapped
+        arc._mapped_file = mapped_file
+        arc._buffer = buffer
+
+        return arc
+
+    def close(self):
+        if self._mmap is None:
+            return
+
+        mapped, mapped_file, buffer = self._mmap, self._mapped_file, self._buffer
+        self._buffer = None
+        self._mmap = None
+        self._mapped_file = None
+
+        try:
+            # Files still referencing the map raise an error on access from now on
+            buffer.release()
+            mapped.close()
+        except BufferError:
+            raise BufferError("Archive was closed while memoryviews returned by File.view() were still in use, "
+                              "the mapping stays open until they are released")
+        finally:
+            mapped_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def listdir(self, path):
         if path == ".":
             return [self.root.name]
@@ -383,6 +841,12 @@ class Archive(object):
             entries.extend(dir.subdirs.keys())
             return entries
 
+    def _root_key(self, rest):
+        # Like Directory paths, the first part of a path given to __getitem__/__setitem__
+        # stands for the root whatever it is called, e.g. "text/grid.bin" in an archive whose
+        # root is "texts". The index keys start with the actual root name.
+        return normalize_path(self.root.name + "/" + rest)
+
     def __getitem__(self, path):
         dirname, rest = split_path(path)
 
@@ -391,8 +855,12 @@ class Archive(object):
                 raise FileNotFoundError(path)
             else:
                 return self.root
-        else:
-            return self.root[rest]
+
+        result = self._index.get(self._root_key(rest))
+        if result is None:
+            raise FileNotFoundError(path)
+
+        return result[1]
 
     def __setitem__(self, path, entry):
         dirname, rest = split_path(path)
@@ -405,24 +873,179 @@ class Archive(object):
             else:
                 raise TypeError("Root entry should be of type directory but is type '{}'".format(type(entry)))
         else:
-            self.root[rest] = entry
+            key = self._root_key(rest)
+            parentkey, name = key.rsplit("/", 1)
+            if parentkey not in self._index:
+                raise FileNotFoundError(path)
 
-    def extract_to(self, path):
-        self.root.extract_to(path)
+            parentpath, parent = self._index[parentkey]
+            if not isinstance(parent, Directory):
+                raise RuntimeError("File", parentpath, "is a directory in path", path, "which should not happen!")
 
-    def write_arc_compressed(self, f):
-        temp = BytesIO()
-        self.write_arc(temp)
-        temp.seek(0)
+            # Replace an existing entry even if the case of its name differs
+            if key in self._index:
+                name = self._index[key][0].rsplit("/", 1)[1]
+            else:
+                name = path.replace("\\", "/").rstrip("/").rsplit("/", 1)[1]
 
-        compress_fast(temp, f)
+            parent[name] = entry
+            self._index_remove(key)
+            self._index_add(parentpath + "/" + name, entry)
 
-    def write_arc(self, f):
-        stringtable = StringTable()
+    def extract_to(self, path, workers=None, skip_unchanged=False):
+        """Extract all files to path, see extract_parallel."""
+        return extract_parallel(self.root, path, workers, skip_unchanged)
 
-        nodes = BytesIO()
-        entries = BytesIO()
-        data = BytesIO()
+    def write_arc_compressed(self, f, level=DEFAULT_LEVEL, fast=False, workers=None):
+        if fast:
+            temp = BytesIO()
+            self.write_arc(temp, workers)
+            temp.seek(0)
+
+            compress_fast(temp, f)
+        else:
+            tables, files, rarc_size = self._build_tables()
+
+            with Yaz0Writer(f, rarc_size, level) as out:
+                self._write_data(out, tables, files, workers)
+
+    def write_arc(self, f, workers=None):
+        tables, files, rarc_size = self._build_tables()
+        self._write_data(f, tables, files, workers)
+
+    def write_arc_update(self, f, compressed=None, level=DEFAULT_LEVEL):
+        """Write the archive again, reusing as much as possible of the archive it was loaded from.
+
+        This needs an archive loaded with lazy=True or open_mmap. Files that were never
+        accessed are copied as raw byte ranges from the source. For Yaz0 output the
+        compressed data of the source is reused for everything that is unchanged, also
+        when it moved because a file before it changed size. Only the tables, the changed
+        files and the first WINDOW_SIZE bytes after every change are compressed again.
+        compressed defaults to the format of the source.
+        """
+        if compressed is None:
+            compressed = self._source_compressed is not None
+
+        tables, files, rarc_size = self._build_tables()
+
+        if not compressed:
+            self._write_data(f, tables, files)
+        elif self._source_compressed is None:
+            with Yaz0Writer(f, rarc_size, level) as out:
+                self._write_data(out, tables, files)
+        else:
+            splices = self._find_splices(tables, files)
+            reused = sum(end - start for start, end, compressed, spliced in splices)
+            print("Reusing compressed data for {0} of {1} bytes".format(reused, rarc_size))
+
+            with Yaz0Writer(f, rarc_size, level) as out:
+                self._write_data(_SpliceWriter(out, splices), tables, files)
+
+    def update_file(self, path, compressed=None, level=DEFAULT_LEVEL):
+        """Replace the archive file at path with the current state of the archive, see write_arc_update.
+
+        Archives opened with open_mmap are closed afterwards.
+        """
+        temppath = path + ".tmp"
+
+        try:
+            with open(temppath, "wb") as f:
+                self.write_arc_update(f, compressed, level)
+
+            self.close()
+            os.replace(temppath, path)
+        except:
+            try:
+                os.remove(temppath)
+            except OSError:
+                pass
+            raise
+
+    def _unchanged_runs(self, tables, files):
+        # (source position, new position, size) of the parts of the new archive that are
+        # identical to the source, in the order they are written
+        source = memoryview(self._source)
+        runs = []
+
+        def add(source_pos, pos, size):
+            if size == 0:
+                return
+
+            if len(runs) > 0:
+                last_source_pos, last_pos, last_size = runs[-1]
+                if last_source_pos + last_size == source_pos and last_pos + last_size == pos:
+                    runs[-1] = (last_source_pos, last_pos, last_size + size)
+                    return
+
+            runs.append((source_pos, pos, size))
+
+        # The tables change as soon as the size or name of a file changes, often only
+        # their start stays the same
+        add(0, 0, common_prefix_length(tables, source[:len(tables)]))
+
+        pos = len(tables)
+        source_pos = unpack_from(">I", source, 0x0C)[0] + 0x20
+        for file in files:
+            size = file.size()
+            padded = (size + 0x1F) & ~0x1F
+
+            if isinstance(file, LazyFile) and file._buffer is self._source:
+                source_pos = file._offset
+                add(source_pos, pos, size)
+            elif file.view() == source[source_pos:source_pos+size]:
+                # Loaded but unchanged files at their old position
+                add(source_pos, pos, size)
+
+            if source[source_pos+size:source_pos+padded] == b"\x00"*(padded-size):
+                add(source_pos+size, pos+size, padded-size)
+
+            pos += padded
+            source_pos += padded
+
+        return runs
+
+    def _find_splices(self, tables, files):
+        # Parts of the compressed source that can be copied into the new archive,
+        # see _SpliceWriter
+        source = memoryview(self._source)
+        compressed = memoryview(self._source_compressed)
+        group_sources, group_positions = find_group_starts(compressed)
+        splices = []
+
+        for source_pos, pos, size in self._unchanged_runs(tables, files):
+            # Back references reach up to WINDOW_SIZE bytes back, those have to be unchanged as well
+            start = source_pos if source_pos == 0 else source_pos + WINDOW_SIZE
+            first = bisect_left(group_positions, start)
+            last = bisect_right(group_positions, source_pos + size) - 1
+
+            if last > first:
+                start, end = group_positions[first], group_positions[last]
+                splices.append((start + pos - source_pos, end + pos - source_pos,
+                                compressed[group_sources[first]:group_sources[last]], source[start:end]))
+
+        return splices
+
+    def _write_data(self, f, tables, files, workers=None):
+        # Second pass of writing: the file data is streamed out one file at a time
+        f.write(tables)
+
+        for data in iter_file_data(files, workers):
+            size = len(data)
+            f.write(data)
+            f.write(b"\x00"*(((size + 0x1F) & ~0x1F) - size))
+
+            if isinstance(data, memoryview):
+                data.release()
+
+    def _build_tables(self):
+        """First pass of writing an archive.
+
+        The header, nodes, file entries and string table only depend on the names and
+        sizes of the files, so they are built without touching any file data.
+        Returns the tables, the files in the order their data has to be written and
+        the size of the whole archive.
+        """
+        stringtable = StringTable()
 
         nodecount = 1
         entries = 0
@@ -442,39 +1065,16 @@ class Archive(object):
             for name in filenames:
                 stringtable.write_string(name)
 
-        f.write(b"RARC")
-        f.write(b"FOO ") # placeholder for filesize
-        write_uint32(f, 0x20)  #Unknown but often 0x20?
-        f.write(b"BAR ") # placeholder for data offset
-        f.write(b"\x00"*16) # 4 unknown ints
-
-        write_uint32(f, nodecount)
-        write_uint32(f, 0x20) # unknown
-        f.write(b"\x00"*4) # 1 unknown ints
-
-        #aligned_file_entry_offset = (0x20 + 44 + (nodecount*16) + 0x1F) & 0x20
-        #write_uint32(f, aligned_file_entry_offset)  # Offset to file entries aligned to multiples of 0x20
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*4) # 1 unknown int
-
-        #aligned_stringtable_offset = aligned_file_entry_offset + ((entries * 20) + 0x1F) & 0x20
-        #write_uint32(f, aligned_stringtable_offset)
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*8) # 2 unknown ints
-
-        node_offset = f.tell()
+        f = BytesIO()
+        f.write(b"\x00"*0x40) # Header is written at the end once all offsets are known
 
         first_file_entry_index = 0
 
         dirlist = []
 
-        #aligned_data_offset = aligned_stringtable_offset + (stringtable.size() + 0x1F) & 0x20
-
-        for i, dirinfo in enumerate(self.root.walk()):
-            dirpath, dirnames, filenames = dirinfo
-            dir = self[dirpath]
+        for i, dir in enumerate(self.root.iter_dirs()):
+            dirnames = dir.subdirs
+            filenames = dir.files
             dir._nodeindex = i
 
             dirlist.append(dir)
@@ -500,8 +1100,9 @@ class Archive(object):
         write_pad32(f)
 
         current_file_entry_offset = f.tell()
-        #assert f.tell() == aligned_file_entry_offset
         fileid = 0
+        files = []
+        filedata_offset = 0
 
         for dir in dirlist:
             for filename, file in dir.files.items():
@@ -510,13 +1111,13 @@ class Archive(object):
                 f.write(b"\x11\x00") # Flag for file+padding
                 write_uint16(f, stringtable.get_string_offset(filename))
 
-                filedata_offset = data.tell()
+                size = file.size()
                 write_uint32(f, filedata_offset) # Write file data offset
-                data.write(file.getvalue()) # Write file data
-                write_uint32(f, data.tell()-filedata_offset) # Write file size
-                write_pad32(data)
+                write_uint32(f, size) # Write file size
                 write_uint32(f, 0)
 
+                files.append(file)
+                filedata_offset += (size + 0x1F) & ~0x1F
                 fileid += 1
 
             specialdirs = [(".", dir), ("..", dir.parent)]
@@ -544,19 +1145,19 @@ class Archive(object):
         stringtablesize = f.tell() - current_stringtable_offset
 
         current_data_offset = f.tell()
+        rarc_size = current_data_offset + filedata_offset
 
-        f.write(data.getvalue())
-
-        rarc_size = f.tell()
-
-        f.seek(4)
+        f.seek(0)
+        f.write(b"RARC")
         write_uint32(f, rarc_size)
-        f.seek(12)
+        write_uint32(f, 0x20)  #Unknown but often 0x20?
         write_uint32(f, current_data_offset-0x20)
         write_uint32(f, rarc_size - current_data_offset)
         write_uint32(f, rarc_size - current_data_offset)
+        f.write(b"\x00"*8) # 2 unknown ints
 
-        f.seek(40)
+        write_uint32(f, nodecount)
+        write_uint32(f, 0x20) # unknown
 
         total_file_entries = first_file_entry_index
         write_uint32(f, total_file_entries)
@@ -564,88 +1165,175 @@ class Archive(object):
         write_uint32(f, stringtablesize)
         write_uint32(f, current_stringtable_offset-0x20)
 
+        return f.getvalue(), files, rarc_size
+
 
+def get_output_path(inputpath, compressed=False):
+    # Default output: folder "<archive>_ext" when extracting, "<folder>.arc"/"<folder>.szs" when packing
+    # (or the original archive name if the folder ends in _ext)
+    inputpath = os.path.normpath(inputpath)
+    path, name = os.path.split(inputpath)
 
+    if os.path.isdir(inputpath):
+        if inputpath.endswith("_ext"):
+            return inputpath[:-4]
+        elif compressed:
+            return inputpath + ".szs"
+        else:
+            return inputpath + ".arc"
+    else:
+        return os.path.join(path, name+"_ext")
+
+
+def find_root_dir(inputpath):
+    # The directory that is packed needs to contain exactly one folder which becomes the archive root
+    inputdir = None
+
+    for entry in os.scandir(inputpath):
+        if entry.is_dir():
+            if inputdir is None:
+                inputdir = entry.name
+            else:
+                raise RuntimeError("Directory {0} contains multiple folders! Only one folder should exist.".format(inputpath))
+
+    if inputdir is None:
+        raise RuntimeError("Directory {0} contains no folders! Exactly one folder should exist.".format(inputpath))
 
+    return os.path.join(inputpath, inputdir)
 
 
+def pack_dir(inputpath, outputpath, yaz0=False, level=DEFAULT_LEVEL, fast=False, workers=None):
+    # Only the directory structure and file sizes are needed up front, file contents
+    # are read by worker threads while the archive is being written.
+    archive = Archive.from_dir(find_root_dir(inputpath), lazy=True)
 
+    with open(outputpath, "wb") as f:
+        if yaz0:
+            archive.write_arc_compressed(f, level=level, fast=fast, workers=workers)
+        else:
+            archive.write_arc(f, workers)
 
 
+def collect_extract_jobs(dir, path, dirpaths, jobs):
+    current_dirpath = os.path.join(path, dir.name)
+    dirpaths.append(current_dirpath)
 
+    for filename, file in dir.files.items():
+        jobs.append((os.path.join(current_dirpath, filename), file))
 
+    for dirname, subdir in dir.subdirs.items():
+        collect_extract_jobs(subdir, current_dirpath, dirpaths, jobs)
 
 
+def file_matches(filepath, data):
+    # Only read the file if the size already matches
+    try:
+        if os.stat(filepath).st_size != len(data):
+            return False
 
+        with open(filepath, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def write_extracted_file(filepath, file, skip_unchanged=False):
+    # Returns False if the file was skipped because it is already up to date
+    data = file.view()
+    try:
+        if skip_unchanged and file_matches(filepath, data):
+            return False
+
+        # os.write doesn't hold the GIL, so the writes of several threads run in parallel
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+    finally:
+        if isinstance(data, memoryview):
+            data.release()
+
+    return True
+
+
+def extract_parallel(dir, path, workers=None, skip_unchanged=False):
+    """Extract dir and everything in it to path, writing files with a pool of threads.
+
+    All directories are created up front. With skip_unchanged files that already
+    exist with the same contents aren't written again. Returns the amount of
+    written and skipped files.
+    """
+    dirpaths = []
+    jobs = []
+    collect_extract_jobs(dir, path, dirpaths, jobs)
+
+    for dirpath in dirpaths:
+        os.makedirs(dirpath, exist_ok=True)
+
+    if workers == 1:
+        results = [write_extracted_file(filepath, file, skip_unchanged) for filepath, file in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda job: write_extracted_file(job[0], job[1], skip_unchanged), jobs))
+
+    written = sum(1 for result in results if result)
+    return written, len(results) - written
+
+
+def extract_archive(inputpath, outputpath, workers=None, skip_unchanged=False):
+    with open(inputpath, "rb") as f:
+        compressed = f.read(4) == b"Yaz0"
+
+        if compressed:
+            f.seek(0)
+            archive = Archive.from_file(f, lazy=True)
+
+    if compressed:
+        written, skipped = archive.extract_to(outputpath, workers, skip_unchanged)
+    else:
+        with Archive.open_mmap(inputpath) as archive:
+            written, skipped = archive.extract_to(outputpath, workers, skip_unchanged)
+
+    if skipped:
+        print("Wrote {0} files, skipped {1} unchanged files".format(written, skipped))
 
 
 if __name__ == "__main__":
     import argparse
-    import os
 
     parser = argparse.ArgumentParser()
     parser.add_argument("input",
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
+    parser.add_argument("--yaz0", action="store_true",
+                        help="Compress archive with yaz0 when doing directory->.arc/.szs")
     parser.add_argument("--yaz0fast", action="store_true",
-                        help="Encode archive as yaz0 when doing directory->.arc/.szs")
+                        help="Encode archive as yaz0 without compression when doing directory->.arc/.szs")
+    parser.add_argument("--level", type=int, default=DEFAULT_LEVEL, choices=sorted(COMPRESSION_LEVELS.keys()),
+                        help="Yaz0 compression level, higher is slower but compresses better. Default: {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Amount of threads used for reading files when packing or writing files when extracting. Default: chosen by Python")
+    parser.add_argument("--skip_unchanged", action="store_true",
+                        help="When extracting, don't write files that already exist with the same contents")
     parser.add_argument("output", default=None, nargs = '?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
 
     args = parser.parse_args()
 
     inputpath = os.path.normpath(args.input)
-    if os.path.isdir(inputpath):
-        dir2arc = True
-    else:
-        dir2arc = False
-
 
     if args.output is None:
-        path, name = os.path.split(inputpath)
-
-        if dir2arc:
-            if args.yaz0fast:
-                ending = ".szs"
-            else:
-                ending = ".arc"
-            
-            if inputpath.endswith("_ext"):
-                outputpath = inputpath[:-4]
-            else:
-                outputpath = inputpath + ending 
-        else:
-            outputpath = os.path.join(path, name+"_ext")
+        outputpath = get_output_path(inputpath, args.yaz0 or args.yaz0fast)
     else:
         outputpath = args.output
 
-    if dir2arc:
-        dirscan = os.scandir(inputpath)
-        inputdir = None 
-        
-        for entry in dirscan:
-            if entry.is_dir():
-                if inputdir is None:
-                    inputdir = entry.name
-                else:
-                    raise RuntimeError("Directory {0} contains multiple folders! Only one folder should exist.".format(inputpath))
-        
-        if inputdir is None:
-            raise RuntimeError("Directory {0} contains no folders! Exactly one folder should exist.".format(inputpath))
-        
+    if os.path.isdir(inputpath):
         print("Packing directory to archive")
-        archive = Archive.from_dir(os.path.join(inputpath, inputdir))
-        print("Directory loaded into memory, writing archive now")
-
-        with open(outputpath, "wb") as f:
-            if args.yaz0fast:
-                archive.write_arc_compressed(f)
-            else:
-                archive.write_arc(f)
+        pack_dir(inputpath, outputpath, yaz0=args.yaz0 or args.yaz0fast, level=args.level, fast=args.yaz0fast,
+                 workers=args.workers)
         print("Done")
     else:
         print("Extracting archive to directory")
-        with open(inputpath, "rb") as f:
-            archive = Archive.from_file(f)
-        archive.extract_to(outputpath)
-
-
+        extract_archive(inputpath, outputpath, workers=args.workers, skip_unchanged=args.skip_unchanged)
@@ -0,0 +1,207 @@
+## Benchmarks for rarc.py and yaz0.py on generated archives.
+## The generated trees are shaped like the archives of the game: a few levels of nested
+## directories, lots of small text files like the gen files and a few large binaries that
+## either compress well (grids, padding) or not at all (already compressed data). Results
+## are written as JSON so runs on different commits can be compared, e.g.
+##   python -m lib.rarc_benchmark --output before.json
+##   python -m lib.rarc_benchmark --output after.json --compare before.json
+
+import os
+import io
+import json
+import random
+import shutil
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from struct import pack
+from timeit import default_timer as time
+
+from . import rarc
+from . import yaz0
+
+TEXT_WORDS = ["teki", "pelt", "item", "pikmin", "onion", "route", "# comment", "{v0.3}", "0.000000",
+              "1.000000", "-150.500000", "{_eof}", "0", "1", "2", "8", "\t", "\t\t"]
+
+
+def generate_text(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choice(TEXT_WORDS) for i in range(rng.randint(1, 8)))
+        lines.append(line)
+        length += len(line) + 1
+
+    return "\n".join(lines).encode("ascii")[:size]
+
+
+def generate_grid(rng, count):
+    # Like grid.bin: lots of floats with a small range of values
+    return b"".join(pack(">fff", rng.randint(-50, 50)*10.0, rng.randint(0, 20)*5.0, rng.randint(-50, 50)*10.0)
+                    for i in range(count))
+
+
+def generate_tree(path, seed=0, scale=1):
+    """Write a synthetic extracted archive to path/root, returns the root path."""
+    rng = random.Random(seed)
+    root = os.path.join(path, "root")
+
+    dirs = [root]
+    for i in range(8*scale):
+        # Mostly shallow directories with a few deep chains
+        parent = rng.choice(dirs)
+        for depth in range(rng.choice((1, 1, 1, 2, 5))):
+            parent = os.path.join(parent, "dir{0}_{1}".format(i, depth))
+            dirs.append(parent)
+
+    for dirpath in dirs:
+        os.makedirs(dirpath, exist_ok=True)
+
+    for i in range(300*scale):
+        with open(os.path.join(rng.choice(dirs), "text{0}.txt".format(i)), "wb") as f:
+            f.write(generate_text(rng, rng.randint(16, 4000)))
+
+    binaries = [
+        ("random.bin", bytes(rng.getrandbits(8) for i in range(512*1024*scale))),
+        ("zeros.bin", b"\x00"*(1024*1024*scale)),
+        ("grid.bin", generate_grid(rng, 40000*scale))
+    ]
+    for name, data in binaries:
+        with open(os.path.join(rng.choice(dirs), name), "wb") as f:
+            f.write(data)
+
+    return root
+
+
+def measure(func, repeat):
+    # Returns the fastest and the median time of repeat runs, output of func is discarded
+    times = []
+    for i in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time()
+            func()
+            times.append(time() - start)
+
+    times.sort()
+    return {"min": times[0], "median": times[len(times)//2], "runs": repeat}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workdir, seed=0, scale=1, level=yaz0.DEFAULT_LEVEL, repeat=3):
+    results = {}
+
+    treedir = os.path.join(workdir, "tree")
+    generate_tree(treedir, seed, scale)
+
+    arcpath = os.path.join(workdir, "bench.arc")
+    szspath = os.path.join(workdir, "bench.szs")
+    extractpath = os.path.join(workdir, "extracted")
+
+    results["pack"] = measure(lambda: rarc.pack_dir(treedir, arcpath), repeat)
+    results["pack_compressed"] = measure(lambda: rarc.pack_dir(treedir, szspath, yaz0=True, level=level), repeat)
+
+    with open(arcpath, "rb") as f:
+        arcdata = f.read()
+    with open(szspath, "rb") as f:
+        szsdata = f.read()
+
+    results["compress"] = measure(lambda: yaz0.compress_data(arcdata, level), repeat)
+    results["decompress"] = measure(lambda: yaz0.decompress_buffer(szsdata), repeat)
+
+    # Parse the archive without the on-disk cache of decompressed archives
+    results["parse"] = measure(lambda: rarc.Archive.from_file(io.BytesIO(arcdata)), repeat)
+    results["parse_lazy"] = measure(lambda: rarc.Archive.from_file(io.BytesIO(arcdata), lazy=True), repeat)
+
+    with redirect_stdout(io.StringIO()):
+        archive = rarc.Archive.from_file(io.BytesIO(arcdata), lazy=True)
+    paths = [path for path, entry in archive.glob("*") if isinstance(entry, rarc.File)]
+
+    def lookup():
+        for path in paths:
+            archive[path]
+    results["lookup"] = measure(lookup, repeat)
+    results["lookup"]["lookups"] = len(paths)
+
+    def extract():
+        shutil.rmtree(extractpath, ignore_errors=True)
+        rarc.extract_archive(arcpath, extractpath)
+    results["extract"] = measure(extract, repeat)
+    results["extract_compressed"] = measure(lambda: rarc.extract_archive(szspath, extractpath), repeat)
+
+    info = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "yaz0_backend": yaz0.BACKEND,
+        "seed": seed,
+        "scale": scale,
+        "level": level,
+        "files": len(paths),
+        "archive_size": len(arcdata),
+        "compressed_size": len(szsdata)
+    }
+
+    return {"info": info, "results": results}
+
+
+def print_results(data, previous=None):
+    for name, result in data["results"].items():
+        line = "{0:20} {1:9.4f}s (median {2:.4f}s)".format(name, result["min"], result["median"])
+
+        if previous is not None and name in previous["results"]:
+            old = previous["results"][name]["min"]
+            if old > 0:
+                line += "  {0:+.1f}% vs {1}".format((result["min"] - old)/old*100, previous["info"]["commit"])
+
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time decompressing, parsing, lookups, extracting, packing and compressing of generated archives.")
+    parser.add_argument("--output", default=None,
+                        help="Write the results as JSON to this file")
+    parser.add_argument("--compare", default=None,
+                        help="JSON file of an earlier run to compare against")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Multiplies the amount of files and the size of the binaries. Default: 1")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for generating the archive contents. Default: 0")
+    parser.add_argument("--level", type=int, default=yaz0.DEFAULT_LEVEL, choices=sorted(yaz0.COMPRESSION_LEVELS.keys()),
+                        help="Yaz0 compression level. Default: {0}".format(yaz0.DEFAULT_LEVEL))
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="How often each benchmark is run, the fastest run is reported. Default: 3")
+
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="rarc_benchmark")
+    try:
+        data = run_benchmarks(workdir, args.seed, args.scale, args.level, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    info = data["info"]
+    print("{0} files, {1} bytes, {2} bytes compressed, {3} Yaz0 backend".format(
+        info["files"], info["archive_size"], info["compressed_size"], info["yaz0_backend"]))
+    print_results(data, previous)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=4)
+        print("Results written to", args.output)
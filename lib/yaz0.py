@@ -3,7 +3,8 @@
 ## Implementation of a yaz0 decoder/encoder in Python, by Yoshi2
 ## Using the specifications in http://www.amnoid.de/gc/yaz0.txt
 
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack
+from array import array
 import os
 import re
 import hashlib
@@ -74,20 +75,21 @@ def decompress(f, out):
             if (code_byte << i) & 0x80:
                 out_write(file_read(1)) # Write next byte as-is without requiring decompression
             else:
-                if file_tell() >= maxsize-1:
+                # A back reference needs at least 2 more bytes of input. Streams written without
+                # padding can end on a back reference so we can't bail out any earlier than that.
+                if file_tell() > maxsize-2:
                     eof = True
                     break
 
                 data = file_read(2)
                 infobyte = data[0] << 8 | data[1]
                 
-                if file_tell() >= maxsize-1:
-                    eof = True
-                    break
-                
                 bytecount = infobyte >> 12 
                 
                 if bytecount == 0:
+                    if file_tell() >= maxsize:
+                        eof = True
+                        break
                     bytecount = file_read(1)[0] + 0x12
                 else:
                     bytecount += 2
@@ -126,6 +128,179 @@ def decompress(f, out):
         print(  "Warning: output is longer than decompressed size for some reason: "
                 "{}/decompressed: {}".format(out.tell(), decompressed_size))
 
+def decompress_buffer_py(data):
+    """Decompress a complete Yaz0 file held in a bytes-like object.
+
+    The output is preallocated and back references are resolved with index
+    arithmetic and slice copies instead of seeking around in an output stream.
+    Returns a memoryview of the decompressed data.
+    """
+    data = bytes(data)
+
+    if data[:4] != b"Yaz0":
+        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(data[:4]))
+
+    decompressed_size = unpack_from(">I", data, 4)[0]
+    out = bytearray(decompressed_size)
+
+    src = 16
+    dst = 0
+    srcsize = len(data)
+
+    try:
+        while dst < decompressed_size:
+            code_byte = data[src]
+            src += 1
+
+            if code_byte == 0xFF and dst + 8 <= decompressed_size and src + 8 <= srcsize:
+                # 8 literal bytes in a row, very common for data that doesn't compress well
+                out[dst:dst+8] = data[src:src+8]
+                src += 8
+                dst += 8
+                continue
+
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if code_byte & bit:
+                    out[dst] = data[src]
+                    src += 1
+                    dst += 1
+                else:
+                    infobyte = data[src]
+                    offset = ((infobyte & 0x0F) << 8 | data[src+1]) + 1
+                    src += 2
+
+                    bytecount = infobyte >> 4
+                    if bytecount == 0:
+                        bytecount = data[src] + 0x12
+                        src += 1
+                    else:
+                        bytecount += 2
+
+                    start = dst - offset
+                    if start < 0:
+                        raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+
+                    if dst + bytecount > decompressed_size:
+                        bytecount = decompressed_size - dst
+
+                    if offset >= bytecount:
+                        out[dst:dst+bytecount] = out[start:start+bytecount]
+                    else:
+                        # Copy source and destination overlap so the last offset bytes
+                        # are repeated until bytecount bytes have been written.
+                        repeats = bytecount // offset + 1
+                        out[dst:dst+bytecount] = (out[start:dst]*repeats)[:bytecount]
+
+                    dst += bytecount
+
+                if dst >= decompressed_size:
+                    break
+    except IndexError:
+        raise RuntimeError("Malformed Yaz0 file: Data ends after {0} of {1} bytes were decompressed".format(
+            dst, decompressed_size))
+
+    return memoryview(out)
+
+
+def decompress_iter(f, chunk_size=0x10000, limit=None, read_size=0x10000):
+    """Decompress the Yaz0 stream f and yield the output in chunks.
+
+    A chunk is yielded as soon as chunk_size bytes are final, only the last
+    WINDOW_SIZE bytes are kept around for resolving back references. The input is
+    read sequentially in blocks of read_size bytes so f doesn't need to be seekable.
+    If limit is set decompression stops after that many bytes of output.
+    """
+    header = f.read(16)
+    if header[:4] != b"Yaz0":
+        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(header[:4]))
+
+    decompressed_size = unpack_from(">I", header, 4)[0]
+    if limit is not None and limit < decompressed_size:
+        decompressed_size = limit
+
+    file_read = f.read
+
+    src = b""
+    srcpos = 0
+    input_done = False
+
+    out = bytearray()
+    emitted = 0     # Position in out up to which data has been yielded
+    total = 0       # Amount of bytes that were removed from the start of out
+
+    while total + len(out) < decompressed_size:
+        # A group is at most 1 code byte + 8 back references of 3 bytes
+        if len(src) - srcpos < 25 and not input_done:
+            src = src[srcpos:]
+            srcpos = 0
+
+            while len(src) < 25:
+                data = file_read(read_size)
+                if not data:
+                    input_done = True
+                    break
+                src += data
+
+        if srcpos >= len(src):
+            raise RuntimeError("Malformed Yaz0 file: Data ends after {0} of {1} bytes were decompressed".format(
+                total+len(out), decompressed_size))
+
+        code_byte = src[srcpos]
+        srcpos += 1
+
+        try:
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if code_byte & bit:
+                    out.append(src[srcpos])
+                    srcpos += 1
+                else:
+                    infobyte = src[srcpos]
+                    offset = ((infobyte & 0x0F) << 8 | src[srcpos+1]) + 1
+                    srcpos += 2
+
+                    bytecount = infobyte >> 4
+                    if bytecount == 0:
+                        bytecount = src[srcpos] + 0x12
+                        srcpos += 1
+                    else:
+                        bytecount += 2
+
+                    start = len(out) - offset
+                    if start < 0:
+                        raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+
+                    if offset >= bytecount:
+                        out += out[start:start+bytecount]
+                    else:
+                        repeats = bytecount // offset + 1
+                        out += (out[start:]*repeats)[:bytecount]
+
+                if total + len(out) >= decompressed_size:
+                    break
+        except IndexError:
+            raise RuntimeError("Malformed Yaz0 file: Data ends after {0} of {1} bytes were decompressed".format(
+                total+len(out), decompressed_size))
+
+        if len(out) - emitted >= chunk_size:
+            yield bytes(out[emitted:])
+
+            # Drop everything that can't be referenced anymore
+            if len(out) > WINDOW_SIZE:
+                removed = len(out) - WINDOW_SIZE
+                del out[:removed]
+                total += removed
+            emitted = len(out)
+
+    end = decompressed_size - total
+    if end > emitted:
+        yield bytes(out[emitted:end])
+
+
+def decompress_head(f, size):
+    """Return only the first size bytes of the decompressed data of the Yaz0 stream f."""
+    return b"".join(decompress_iter(f, limit=size))
+
+
 def compress_fast(f, out):
     data = f.read()
     
@@ -149,3 +324,491 @@ def compress_fast(f, out):
         
         out_write(b"\xFF") # Set all bits in the code byte to 1 to mark the following 8 bytes as copy
         out_write(tocopy)
+
+
+# Yaz0 can refer back at most 0x1000 bytes and copy between 3 and 0x111 bytes at once.
+WINDOW_SIZE = 0x1000
+MIN_MATCH = 3
+MAX_MATCH = 0x111
+
+# Compression level -> (maximum amount of hash chain entries checked per position, lazy matching)
+# Lazy matching checks if the next position has a longer match before committing to the current one,
+# the same trick Nintendo's encoder uses.
+COMPRESSION_LEVELS = {
+    1: (1, False),
+    2: (4, False),
+    3: (8, False),
+    4: (16, False),
+    5: (32, True),
+    6: (64, True),
+    7: (256, True),
+    8: (1024, True),
+    9: (WINDOW_SIZE, True)
+}
+DEFAULT_LEVEL = 6
+
+
+def get_level(level):
+    if level not in COMPRESSION_LEVELS:
+        raise ValueError("Unknown compression level {0}, should be one of {1}".format(
+            level, sorted(COMPRESSION_LEVELS.keys())))
+
+    return COMPRESSION_LEVELS[level]
+
+
+def compress_data(data, level=DEFAULT_LEVEL):
+    """Encode data and return the Yaz0 stream without the 16 byte header."""
+    max_chain, lazy = get_level(level)
+    return _compress_data(data, max_chain, lazy)
+
+
+def compress_data_py(data, level=DEFAULT_LEVEL):
+    """Pure Python version of compress_data."""
+    max_chain, lazy = get_level(level)
+    return _compress_data_py(data, max_chain, lazy)
+
+
+def _compress_data_py(data, max_chain, lazy):
+    encoder = Yaz0StreamPy(max_chain, lazy)
+    out = encoder.feed(data)
+    out += encoder.finish()
+    return out
+
+
+# Input is only encoded once LOOKAHEAD bytes past the current position are available:
+# lazy matching looks at pos+1 and every position covered by a match is added to the
+# hash chains. That way feeding the input in pieces gives exactly the same output as
+# encoding it in one go.
+LOOKAHEAD = MAX_MATCH + MIN_MATCH
+
+
+class Yaz0StreamPy(object):
+    """Incremental Yaz0 encoder, feed() and finish() return the encoded data that is final.
+
+    Matches are found with hash chains: head maps every 3-byte sequence to the last
+    position it was seen at and prev links each position to the previous occurrence
+    of the same sequence. Only the last WINDOW_SIZE bytes of input are kept.
+    """
+    def __init__(self, max_chain, lazy):
+        self.max_chain = max_chain
+        self.lazy = lazy
+
+        self.buf = b""      # Input from absolute position base up to end
+        self.base = 0
+        self.end = 0
+        self.pos = 0        # Next position to encode
+
+        self.head = {}
+        self.prev = [-1]*WINDOW_SIZE    # Indexed by position % WINDOW_SIZE, only valid inside the window
+        self.next_match = None
+
+        self.group = bytearray()    # Up to 8 tokens that aren't written yet, group[0] is the code byte
+        self.bit = 0
+
+    def prime(self, history):
+        # Fill the window with data that was already encoded elsewhere, so the output
+        # can continue an existing Yaz0 stream. Has to be called before feed().
+        self.buf = bytes(history)
+        self.end = len(self.buf)
+
+        head = self.head
+        for pos in range(self.end - MIN_MATCH + 1):
+            key = self.buf[pos:pos+MIN_MATCH]
+            self.prev[pos % WINDOW_SIZE] = head.get(key, -1)
+            head[key] = pos
+
+        self.pos = self.end
+
+    def feed(self, data):
+        keep_from = self.pos - WINDOW_SIZE
+
+        if keep_from > self.base:
+            self.buf = self.buf[keep_from-self.base:] + bytes(data)
+            self.base = keep_from
+
+            # Positions outside of the window are never used again
+            if len(self.head) > 0x10000:
+                self.head = {key: pos for key, pos in self.head.items() if pos >= keep_from}
+        else:
+            self.buf += bytes(data)
+
+        self.end = self.base + len(self.buf)
+
+        return self._encode(self.end - LOOKAHEAD)
+
+    def finish(self):
+        out = self._encode(self.end)
+        out += self.group
+        self.group = bytearray()
+
+        return out
+
+    def _encode(self, stop):
+        data = self.buf
+        base = self.base
+        end = self.end
+        head = self.head
+        head_get = head.get
+        prev = self.prev
+        max_chain = self.max_chain
+        lazy = self.lazy
+
+        def find_match(pos):
+            # Returns (length, position) of the longest match found for pos, length is 0 if nothing was found.
+            limit = end - pos
+            if limit < MIN_MATCH:
+                return 0, 0
+            if limit > MAX_MATCH:
+                limit = MAX_MATCH
+
+            current = pos - base
+            window_start = pos - WINDOW_SIZE
+            candidate = head_get(data[current:current+MIN_MATCH], -1)
+            chain = max_chain
+            best_len = 0
+            best_pos = 0
+
+            while candidate >= window_start and candidate >= 0 and chain > 0:
+                previous = candidate - base
+
+                # Candidates that can't beat the current best match are rejected with a single comparison
+                if data[previous+best_len] == data[current+best_len]:
+                    if data[previous:previous+limit] == data[current:current+limit]:
+                        return limit, candidate
+
+                    # Every candidate on the chain shares the first 3 bytes with pos
+                    length = MIN_MATCH
+                    while data[previous+length] == data[current+length]:
+                        length += 1
+
+                    if length > best_len:
+                        best_len = length
+                        best_pos = candidate
+
+                candidate = prev[candidate % WINDOW_SIZE]
+                chain -= 1
+
+            return best_len, best_pos
+
+        def insert(pos):
+            if pos + MIN_MATCH <= end:
+                key = data[pos-base:pos-base+MIN_MATCH]
+                prev[pos % WINDOW_SIZE] = head_get(key, -1)
+                head[key] = pos
+
+        out = bytearray()
+        group = self.group
+        bit = self.bit
+        pos = self.pos
+        next_match = self.next_match
+
+        while pos < stop:
+            if next_match is not None:
+                length, match_pos = next_match
+                next_match = None
+            else:
+                length, match_pos = find_match(pos)
+
+            insert(pos)
+
+            if lazy and length >= MIN_MATCH and length < MAX_MATCH:
+                next_match = find_match(pos+1)
+                if next_match[0] > length:
+                    # Emit a literal now and take the longer match on the next position instead
+                    length = 0
+                else:
+                    next_match = None
+
+            if bit == 0:
+                group.append(0)
+                bit = 0x80
+
+            if length >= MIN_MATCH:
+                distance = pos - match_pos - 1
+
+                if length >= 0x12:
+                    group.append(distance >> 8)
+                    group.append(distance & 0xFF)
+                    group.append(length - 0x12)
+                else:
+                    group.append(((length - 2) << 4) | (distance >> 8))
+                    group.append(distance & 0xFF)
+
+                for i in range(pos+1, pos+length):
+                    insert(i)
+                pos += length
+            else:
+                group[0] |= bit
+                group.append(data[pos-base])
+                pos += 1
+
+            bit >>= 1
+            if bit == 0:
+                out += group
+                group = bytearray()
+
+        self.group = group
+        self.bit = bit
+        self.pos = pos
+        self.next_match = next_match
+
+        return out
+
+
+def find_group_starts(data):
+    """Return the offsets in data (which includes the header) at which the groups of
+    8 tokens of a Yaz0 stream start, and the decompressed positions there.
+
+    The end of the stream is included if the last group is complete. Everything before
+    one of these points only depends on the decompressed data before it, so the stream
+    can be cut there, see Yaz0Writer.splice.
+    """
+    decompressed_size = unpack_from(">I", data, 4)[0]
+
+    sources = array("Q")
+    positions = array("Q")
+
+    src = 16
+    dst = 0
+    tokens = 8
+
+    while dst < decompressed_size and src < len(data):
+        sources.append(src)
+        positions.append(dst)
+
+        code_byte = data[src]
+        src += 1
+        tokens = 0
+
+        for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+            if dst >= decompressed_size:
+                break
+            tokens += 1
+
+            if code_byte & bit:
+                src += 1
+                dst += 1
+            else:
+                bytecount = data[src] >> 4
+                src += 2
+
+                if bytecount == 0:
+                    bytecount = data[src] + 0x12
+                    src += 1
+                else:
+                    bytecount += 2
+
+                dst += bytecount
+
+    # The end of the stream only works as a cut if the last group is complete,
+    # otherwise its unused bits would be read as back references.
+    if dst == decompressed_size and tokens == 8:
+        sources.append(src)
+        positions.append(dst)
+
+    return sources, positions
+
+
+def read_tokens(encoded):
+    # Split encoded data that starts at a group boundary into (length, token) for every
+    # token, token is the encoded literal or back reference without the code byte.
+    tokens = []
+    src = 0
+
+    while src < len(encoded):
+        code_byte = encoded[src]
+        src += 1
+
+        for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+            if src >= len(encoded):
+                break
+
+            if code_byte & bit:
+                tokens.append((1, encoded[src:src+1]))
+                src += 1
+            elif encoded[src] >> 4 == 0:
+                tokens.append((encoded[src+2] + 0x12, encoded[src:src+3]))
+                src += 3
+            else:
+                tokens.append(((encoded[src] >> 4) + 2, encoded[src:src+2]))
+                src += 2
+
+    return tokens
+
+
+def encode_reference(length, token):
+    # Back reference over length bytes with the same distance as the reference token
+    distance = ((token[0] & 0xF) << 8) | token[1]
+
+    if length >= 0x12:
+        return bytes((distance >> 8, distance & 0xFF, length - 0x12))
+    else:
+        return bytes((((length - 2) << 4) | (distance >> 8), distance & 0xFF))
+
+
+def write_groups(tokens):
+    out = bytearray()
+
+    for i in range(0, len(tokens), 8):
+        code_pos = len(out)
+        out.append(0)
+
+        for bit, (length, token) in zip((0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01), tokens[i:i+8]):
+            if length == 1:
+                out[code_pos] |= bit
+            out += token
+
+    return out
+
+
+def complete_groups(encoded, decoded):
+    """Re-encode encoded so that it ends with a complete group, or return None if that isn't possible.
+
+    encoded has to start at a group boundary and decode to decoded. Tokens are added by
+    turning the first bytes of back references into literals, starting at the end.
+    """
+    tokens = read_tokens(encoded)
+    missing = -len(tokens) % 8
+    pos = len(decoded)
+
+    for i in range(len(tokens) - 1, -1, -1):
+        if missing == 0:
+            break
+
+        length, token = tokens[i]
+        pos -= length
+        if length == 1:
+            continue
+
+        literals = [(1, decoded[j:j+1]) for j in range(pos, pos+length)]
+        if missing <= length - MIN_MATCH:
+            # Shorter reference with the same distance after some literals
+            tokens[i:i+1] = literals[:missing] + [(length - missing, encode_reference(length - missing, token))]
+            missing = 0
+        else:
+            tokens[i:i+1] = literals
+            missing = (missing - (length - 1)) % 8
+
+    if missing != 0:
+        return None
+
+    return write_groups(tokens)
+
+
+class Yaz0Writer(object):
+    """File-like object that Yaz0 compresses everything written to it into out.
+
+    The decompressed size has to be known in advance because it is part of the header.
+    Only the compression window is kept in memory, not the whole input.
+    """
+    def __init__(self, out, size, level=DEFAULT_LEVEL):
+        self._max_chain, self._lazy = get_level(level)
+
+        self._out = out
+        self._size = size
+        self._written = 0
+        self._history = bytearray()     # The last bytes that were written, at most 2*WINDOW_SIZE
+        self._encoder = _new_stream(self._max_chain, self._lazy)
+
+        out.write(b"Yaz0")
+        out.write(pack(">I", size))
+        out.write(b"\x00"*8)
+
+    def _add_history(self, data):
+        if len(data) >= 2*WINDOW_SIZE:
+            self._history = bytearray(data[-2*WINDOW_SIZE:])
+        else:
+            self._history += data
+            del self._history[:-2*WINDOW_SIZE]
+
+    def splice(self, compressed, data):
+        """Continue the stream with data that was already encoded elsewhere.
+
+        compressed has to be complete groups that decode to data, see find_group_starts.
+        Its back references can only point into data and the WINDOW_SIZE bytes written
+        before it. The tokens encoded so far are adjusted to end on a group boundary; if
+        they are all literals that isn't possible and data is encoded again instead.
+        data has to be at least 8 bytes long. Returns whether compressed was used.
+        """
+        data = memoryview(data)
+        if len(data) < 8:
+            self.write(data)
+            return False
+
+        tail = self._encoder.finish()
+        tokens = read_tokens(tail)
+        decoded_size = sum(length for length, token in tokens)
+
+        aligned = None
+        if decoded_size <= len(self._history):
+            aligned = complete_groups(tail, self._history[len(self._history)-decoded_size:])
+
+        if aligned is not None:
+            self._out.write(aligned)
+            self._out.write(compressed)
+            self._written += len(data)
+            self._add_history(data)
+            rest = data[len(data):]
+        else:
+            # Fill the last group with literals from data and encode the rest of data again
+            filler = data[:-len(tokens) % 8].tobytes()
+            self._out.write(write_groups(tokens + [(1, filler[i:i+1]) for i in range(len(filler))]))
+            self._written += len(filler)
+            self._add_history(filler)
+            rest = data[len(filler):]
+
+        self._encoder = _new_stream(self._max_chain, self._lazy)
+        self._encoder.prime(self._history[-WINDOW_SIZE:])
+        if len(rest) > 0:
+            self.write(rest)
+
+        return aligned is not None
+
+    def write(self, data):
+        self._written += len(data)
+        self._add_history(data)
+        self._out.write(self._encoder.feed(data))
+
+    def tell(self):
+        return self._written
+
+    def close(self):
+        if self._encoder is not None:
+            if self._written != self._size:
+                raise RuntimeError("Yaz0 header says {0} bytes but {1} bytes were written".format(
+                    self._size, self._written))
+
+            self._out.write(self._encoder.finish())
+            self._encoder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+def compress(f, out, level=DEFAULT_LEVEL):
+    data = f.read()
+
+    out.write(b"Yaz0")
+    out.write(pack(">I", len(data)))
+    out.write(b"\x00"*8)
+    out.write(compress_data(data, level))
+
+
+# Use the native codec from yaz0_native.c if it has been built, otherwise fall back to Python.
+try:
+    from . import yaz0_native
+    yaz0_native.load()
+except (ImportError, OSError):
+    BACKEND = "python"
+    decompress_buffer = decompress_buffer_py
+    _compress_data = _compress_data_py
+    _new_stream = Yaz0StreamPy
+else:
+    BACKEND = "native"
+    decompress_buffer = yaz0_native.decompress_buffer_native
+    _compress_data = yaz0_native.compress_data_native
+    _new_stream = yaz0_native.Yaz0StreamNative
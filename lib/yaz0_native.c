@@ -0,0 +1,366 @@
+/* Native Yaz0 decoder/encoder, loaded with ctypes by lib/yaz0_native.py.
+ *
+ * The encoder is a direct port of compress_data_py in lib/yaz0.py and has to
+ * produce exactly the same output: hash chains are walked in the same order,
+ * candidates are accepted under the same conditions and lazy matching is
+ * decided the same way. Build with "python -m lib.yaz0_native".
+ */
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifdef _WIN32
+#define EXPORT __declspec(dllexport)
+#else
+#define EXPORT
+#endif
+
+#define WINDOW_SIZE 0x1000
+#define MIN_MATCH 3
+#define MAX_MATCH 0x111
+
+#define HASH_BITS 15
+#define HASH_SIZE (1 << HASH_BITS)
+
+#define YAZ0_ERR_SEEKBACK -1
+#define YAZ0_ERR_TRUNCATED -2
+#define YAZ0_ERR_MEMORY -3
+
+/* Returns the amount of decompressed bytes (dstlen) or a negative error code.
+ * src points at the compressed data after the 16 byte header. */
+EXPORT int64_t yaz0_decode(const uint8_t *src, int64_t srclen, uint8_t *dst, int64_t dstlen)
+{
+    int64_t s = 0;
+    int64_t d = 0;
+
+    while (d < dstlen) {
+        if (s >= srclen)
+            return YAZ0_ERR_TRUNCATED;
+
+        uint8_t code = src[s++];
+
+        for (int bit = 0x80; bit != 0 && d < dstlen; bit >>= 1) {
+            if (code & bit) {
+                if (s >= srclen)
+                    return YAZ0_ERR_TRUNCATED;
+                dst[d++] = src[s++];
+            } else {
+                if (s + 2 > srclen)
+                    return YAZ0_ERR_TRUNCATED;
+
+                int64_t offset = (((src[s] & 0x0F) << 8) | src[s+1]) + 1;
+                int64_t count = src[s] >> 4;
+                s += 2;
+
+                if (count == 0) {
+                    if (s >= srclen)
+                        return YAZ0_ERR_TRUNCATED;
+                    count = src[s++] + 0x12;
+                } else {
+                    count += 2;
+                }
+
+                if (d - offset < 0)
+                    return YAZ0_ERR_SEEKBACK;
+                if (d + count > dstlen)
+                    count = dstlen - d;
+
+                /* Byte by byte on purpose, overlapping copies repeat the source */
+                const uint8_t *copy = dst + d - offset;
+                for (int64_t i = 0; i < count; i++)
+                    dst[d + i] = copy[i];
+                d += count;
+            }
+        }
+    }
+
+    return d;
+}
+
+/* Input is only encoded once LOOKAHEAD bytes past the current position are
+ * available: lazy matching looks at pos+1 and every position covered by a match
+ * is added to the hash chains. That way feeding the input in pieces gives
+ * exactly the same output as encoding it in one go. */
+#define LOOKAHEAD (MAX_MATCH + MIN_MATCH)
+#define MAX_GROUP_SIZE (1 + 8*3)
+
+typedef struct {
+    int max_chain;
+    int lazy;
+
+    uint8_t *buf;       /* Input from absolute position base up to end */
+    int64_t bufcap;
+    int64_t base;
+    int64_t end;
+    int64_t pos;        /* Next position to encode */
+
+    int64_t head[HASH_SIZE];
+    int64_t prev[WINDOW_SIZE];  /* Indexed by position % WINDOW_SIZE, only valid inside the window */
+
+    int have_next;
+    int64_t next_len;
+    int64_t next_pos;
+
+    uint8_t group[MAX_GROUP_SIZE];  /* Up to 8 tokens that aren't written yet, group[0] is the code byte */
+    int group_len;
+    uint8_t bit;
+} yaz0_stream;
+
+static inline uint32_t hash3(const uint8_t *p)
+{
+    uint32_t v = ((uint32_t)p[0] << 16) | ((uint32_t)p[1] << 8) | p[2];
+    return (v * 2654435761u) >> (32 - HASH_BITS);
+}
+
+static inline int same3(const uint8_t *a, const uint8_t *b)
+{
+    return a[0] == b[0] && a[1] == b[1] && a[2] == b[2];
+}
+
+/* Buckets can contain positions of other 3-byte sequences. Those are skipped
+ * without counting them against max_chain so the candidates that are checked
+ * are the same ones the Python encoder sees. */
+static int64_t find_match(yaz0_stream *s, int64_t pos, int64_t *match_pos)
+{
+    int64_t limit = s->end - pos;
+    if (limit < MIN_MATCH)
+        return 0;
+    if (limit > MAX_MATCH)
+        limit = MAX_MATCH;
+
+    const uint8_t *current = s->buf + (pos - s->base);
+    int64_t window_start = pos - WINDOW_SIZE;
+    int64_t candidate = s->head[hash3(current)];
+    int chain = s->max_chain;
+    int64_t best_len = 0;
+    int64_t best_pos = 0;
+
+    while (candidate >= window_start && candidate >= 0 && chain > 0) {
+        const uint8_t *previous = s->buf + (candidate - s->base);
+
+        if (!same3(previous, current)) {
+            candidate = s->prev[candidate % WINDOW_SIZE];
+            continue;
+        }
+
+        if (previous[best_len] == current[best_len]) {
+            int64_t length = MIN_MATCH;
+            while (length < limit && previous[length] == current[length])
+                length++;
+
+            if (length == limit) {
+                *match_pos = candidate;
+                return limit;
+            }
+            if (length > best_len) {
+                best_len = length;
+                best_pos = candidate;
+            }
+        }
+
+        candidate = s->prev[candidate % WINDOW_SIZE];
+        chain--;
+    }
+
+    *match_pos = best_pos;
+    return best_len;
+}
+
+static inline void insert(yaz0_stream *s, int64_t pos)
+{
+    if (pos + MIN_MATCH <= s->end) {
+        uint32_t h = hash3(s->buf + (pos - s->base));
+        s->prev[pos % WINDOW_SIZE] = s->head[h];
+        s->head[h] = pos;
+    }
+}
+
+/* Encodes all positions before stop, returns the amount of bytes written to dst */
+static int64_t encode(yaz0_stream *s, int64_t stop, uint8_t *dst)
+{
+    int64_t out = 0;
+
+    while (s->pos < stop) {
+        int64_t pos = s->pos;
+        int64_t length, match_pos = 0;
+
+        if (s->have_next) {
+            length = s->next_len;
+            match_pos = s->next_pos;
+            s->have_next = 0;
+        } else {
+            length = find_match(s, pos, &match_pos);
+        }
+
+        insert(s, pos);
+
+        if (s->lazy && length >= MIN_MATCH && length < MAX_MATCH) {
+            s->next_len = find_match(s, pos + 1, &s->next_pos);
+            if (s->next_len > length) {
+                /* Emit a literal now and take the longer match on the next position instead */
+                s->have_next = 1;
+                length = 0;
+            }
+        }
+
+        if (s->bit == 0) {
+            s->group[0] = 0;
+            s->group_len = 1;
+            s->bit = 0x80;
+        }
+
+        if (length >= MIN_MATCH) {
+            int64_t distance = pos - match_pos - 1;
+
+            if (length >= 0x12) {
+                s->group[s->group_len++] = (uint8_t)(distance >> 8);
+                s->group[s->group_len++] = (uint8_t)(distance & 0xFF);
+                s->group[s->group_len++] = (uint8_t)(length - 0x12);
+            } else {
+                s->group[s->group_len++] = (uint8_t)(((length - 2) << 4) | (distance >> 8));
+                s->group[s->group_len++] = (uint8_t)(distance & 0xFF);
+            }
+
+            for (int64_t i = pos + 1; i < pos + length; i++)
+                insert(s, i);
+            s->pos = pos + length;
+        } else {
+            s->group[0] |= s->bit;
+            s->group[s->group_len++] = s->buf[pos - s->base];
+            s->pos = pos + 1;
+        }
+
+        s->bit >>= 1;
+        if (s->bit == 0) {
+            memcpy(dst + out, s->group, s->group_len);
+            out += s->group_len;
+            s->group_len = 0;
+        }
+    }
+
+    return out;
+}
+
+static int append(yaz0_stream *s, const uint8_t *src, int64_t len)
+{
+    /* Drop everything that can't be referenced anymore */
+    int64_t keep_from = s->pos - WINDOW_SIZE;
+    if (keep_from > s->base) {
+        memmove(s->buf, s->buf + (keep_from - s->base), s->end - keep_from);
+        s->base = keep_from;
+    }
+
+    int64_t needed = (s->end - s->base) + len;
+    if (needed > s->bufcap) {
+        int64_t newcap = s->bufcap * 2 > needed ? s->bufcap * 2 : needed;
+        uint8_t *newbuf = realloc(s->buf, newcap);
+        if (newbuf == NULL)
+            return YAZ0_ERR_MEMORY;
+        s->buf = newbuf;
+        s->bufcap = newcap;
+    }
+
+    memcpy(s->buf + (s->end - s->base), src, len);
+    s->end += len;
+    return 0;
+}
+
+/* Upper bound for the output of a single yaz0_stream_feed or yaz0_stream_finish call */
+EXPORT int64_t yaz0_stream_bound(int64_t len)
+{
+    int64_t tokens = len + LOOKAHEAD;
+    return tokens + (tokens + 7) / 8 + MAX_GROUP_SIZE;
+}
+
+EXPORT yaz0_stream *yaz0_stream_new(int max_chain, int lazy)
+{
+    yaz0_stream *s = malloc(sizeof(yaz0_stream));
+    if (s == NULL)
+        return NULL;
+
+    memset(s, 0, sizeof(yaz0_stream));
+    s->max_chain = max_chain;
+    s->lazy = lazy;
+    for (int i = 0; i < HASH_SIZE; i++)
+        s->head[i] = -1;
+
+    return s;
+}
+
+EXPORT void yaz0_stream_free(yaz0_stream *s)
+{
+    if (s != NULL) {
+        free(s->buf);
+        free(s);
+    }
+}
+
+/* Fills the window with data that was already encoded elsewhere, so the stream
+ * can continue an existing Yaz0 stream. Has to be called before yaz0_stream_feed. */
+EXPORT int64_t yaz0_stream_prime(yaz0_stream *s, const uint8_t *src, int64_t len)
+{
+    if (append(s, src, len) != 0)
+        return YAZ0_ERR_MEMORY;
+
+    for (int64_t i = s->pos; i < s->end; i++)
+        insert(s, i);
+    s->pos = s->end;
+
+    return 0;
+}
+
+/* Adds input and writes the encoded data that is final to dst which needs room
+ * for yaz0_stream_bound(len) bytes. Returns the amount of bytes written or a
+ * negative error code. */
+EXPORT int64_t yaz0_stream_feed(yaz0_stream *s, const uint8_t *src, int64_t len, uint8_t *dst, int64_t dstcap)
+{
+    if (dstcap < yaz0_stream_bound(len))
+        return YAZ0_ERR_MEMORY;
+    if (append(s, src, len) != 0)
+        return YAZ0_ERR_MEMORY;
+
+    return encode(s, s->end - LOOKAHEAD, dst);
+}
+
+/* Encodes the remaining input, dst needs room for yaz0_stream_bound(0) bytes. */
+EXPORT int64_t yaz0_stream_finish(yaz0_stream *s, uint8_t *dst, int64_t dstcap)
+{
+    if (dstcap < yaz0_stream_bound(0))
+        return YAZ0_ERR_MEMORY;
+
+    int64_t out = encode(s, s->end, dst);
+    if (s->group_len > 0) {
+        memcpy(dst + out, s->group, s->group_len);
+        out += s->group_len;
+        s->group_len = 0;
+    }
+
+    return out;
+}
+
+/* Writes the Yaz0 stream without header to dst, which needs room for at least
+ * srclen + (srclen + 7) / 8 bytes. Returns the amount of bytes written or a
+ * negative error code. */
+EXPORT int64_t yaz0_encode(const uint8_t *src, int64_t srclen, uint8_t *dst, int64_t dstcap,
+                           int max_chain, int lazy)
+{
+    if (dstcap < srclen + (srclen + 7) / 8)
+        return YAZ0_ERR_MEMORY;
+
+    yaz0_stream *s = yaz0_stream_new(max_chain, lazy);
+    if (s == NULL || append(s, src, srclen) != 0) {
+        yaz0_stream_free(s);
+        return YAZ0_ERR_MEMORY;
+    }
+
+    /* The whole input is known, so everything can be encoded right away */
+    int64_t out = encode(s, s->end, dst);
+    if (s->group_len > 0) {
+        memcpy(dst + out, s->group, s->group_len);
+        out += s->group_len;
+    }
+
+    yaz0_stream_free(s);
+    return out;
+}
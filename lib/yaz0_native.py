@@ -0,0 +1,247 @@
+## ctypes bindings for the optional native Yaz0 codec in yaz0_native.c.
+## Build the shared library with "python -m lib.yaz0_native", lib/yaz0.py picks it up
+## automatically on the next import and falls back to Python if it is missing.
+
+import ctypes
+import io
+import os
+import subprocess
+from struct import unpack_from
+
+LIBRARY_NAME = "_yaz0.dll" if os.name == "nt" else "_yaz0.so"
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), LIBRARY_NAME)
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yaz0_native.c")
+
+YAZ0_ERR_SEEKBACK = -1
+YAZ0_ERR_TRUNCATED = -2
+YAZ0_ERR_MEMORY = -3
+
+_lib = None
+
+
+def load():
+    # Raises OSError if the library hasn't been built, lib/yaz0.py relies on that.
+    global _lib
+
+    if _lib is None:
+        lib = ctypes.CDLL(LIBRARY_PATH)
+
+        lib.yaz0_decode.restype = ctypes.c_int64
+        lib.yaz0_decode.argtypes = [ctypes.c_char_p, ctypes.c_int64, ctypes.c_void_p, ctypes.c_int64]
+
+        lib.yaz0_encode.restype = ctypes.c_int64
+        lib.yaz0_encode.argtypes = [ctypes.c_char_p, ctypes.c_int64, ctypes.c_void_p, ctypes.c_int64,
+                                    ctypes.c_int, ctypes.c_int]
+
+        lib.yaz0_stream_bound.restype = ctypes.c_int64
+        lib.yaz0_stream_bound.argtypes = [ctypes.c_int64]
+        lib.yaz0_stream_new.restype = ctypes.c_void_p
+        lib.yaz0_stream_new.argtypes = [ctypes.c_int, ctypes.c_int]
+        lib.yaz0_stream_free.restype = None
+        lib.yaz0_stream_free.argtypes = [ctypes.c_void_p]
+        lib.yaz0_stream_feed.restype = ctypes.c_int64
+        lib.yaz0_stream_feed.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int64, ctypes.c_void_p, ctypes.c_int64]
+        lib.yaz0_stream_prime.restype = ctypes.c_int64
+        lib.yaz0_stream_prime.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int64]
+        lib.yaz0_stream_finish.restype = ctypes.c_int64
+        lib.yaz0_stream_finish.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int64]
+        _lib = lib
+
+    return _lib
+
+
+def decompress_buffer_native(data):
+    data = bytes(data)
+
+    if data[:4] != b"Yaz0":
+        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(data[:4]))
+
+    decompressed_size = unpack_from(">I", data, 4)[0]
+    out = bytearray(decompressed_size)
+    out_ptr = (ctypes.c_char * decompressed_size).from_buffer(out) if decompressed_size > 0 else None
+
+    result = _lib.yaz0_decode(data[16:], len(data) - 16, out_ptr, decompressed_size)
+
+    if result == YAZ0_ERR_SEEKBACK:
+        raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+    elif result == YAZ0_ERR_TRUNCATED:
+        raise RuntimeError("Malformed Yaz0 file: Data ends before {0} bytes were decompressed".format(
+            decompressed_size))
+
+    del out_ptr
+    return memoryview(out)
+
+
+def compress_data_native(data, max_chain, lazy):
+    data = bytes(data)
+    size = len(data)
+    capacity = size + (size + 7) // 8
+
+    out = bytearray(capacity)
+    out_ptr = (ctypes.c_char * capacity).from_buffer(out) if capacity > 0 else None
+
+    result = _lib.yaz0_encode(data, size, out_ptr, capacity, max_chain, int(lazy))
+    if result < 0:
+        raise MemoryError("Native Yaz0 encoder failed with error code {0}".format(result))
+
+    del out_ptr
+    del out[result:]
+    return out
+
+
+class Yaz0StreamNative(object):
+    """Incremental encoder with the same interface as yaz0.Yaz0StreamPy."""
+    def __init__(self, max_chain, lazy):
+        self._stream = _lib.yaz0_stream_new(max_chain, int(lazy))
+        if not self._stream:
+            raise MemoryError("Couldn't create native Yaz0 encoder")
+
+    def _call(self, func, data, *args):
+        capacity = _lib.yaz0_stream_bound(len(data))
+        out = bytearray(capacity)
+        out_ptr = (ctypes.c_char * capacity).from_buffer(out)
+
+        result = func(self._stream, *args, out_ptr, capacity)
+        if result < 0:
+            raise MemoryError("Native Yaz0 encoder failed with error code {0}".format(result))
+
+        del out_ptr
+        del out[result:]
+        return out
+
+    def prime(self, history):
+        history = bytes(history)
+        if _lib.yaz0_stream_prime(self._stream, history, len(history)) < 0:
+            raise MemoryError("Couldn't prime native Yaz0 encoder")
+
+    def feed(self, data):
+        data = bytes(data)
+        return self._call(_lib.yaz0_stream_feed, data, data, len(data))
+
+    def finish(self):
+        try:
+            return self._call(_lib.yaz0_stream_finish, b"")
+        finally:
+            self.close()
+
+    def close(self):
+        if self._stream is not None:
+            _lib.yaz0_stream_free(self._stream)
+            self._stream = None
+
+    def __del__(self):
+        self.close()
+
+
+def build(compiler=None):
+    if compiler is None:
+        compiler = os.environ.get("CC", "cc")
+
+    subprocess.check_call([compiler, "-O2", "-shared", "-fPIC", SOURCE_PATH, "-o", LIBRARY_PATH])
+
+
+def find_mismatch(data, level, native=True):
+    # Returns what doesn't match for data at level, or None if all backends agree.
+    # With native=False only the Python backend is checked against the reference decoder.
+    from . import yaz0
+
+    max_chain, lazy = yaz0.COMPRESSION_LEVELS[level]
+    encoded = yaz0.compress_data_py(data, level)
+
+    if native and compress_data_native(data, max_chain, lazy) != encoded:
+        return "encoding"
+
+    # Feeding the data in pieces has to give the same result as encoding it at once
+    streams = [yaz0.Yaz0StreamPy(max_chain, lazy)]
+    if native:
+        streams.append(Yaz0StreamNative(max_chain, lazy))
+
+    for stream in streams:
+        out = bytearray()
+        for i in range(0, len(data), 1000 + level*777):
+            out += stream.feed(data[i:i+1000+level*777])
+        out += stream.finish()
+
+        if out != encoded:
+            return "streamed encoding"
+
+    compressed = b"Yaz0" + len(data).to_bytes(4, "big") + b"\x00"*8 + bytes(encoded)
+    python = yaz0.decompress_buffer_py(compressed)
+
+    # The old stream based decoder is kept as the reference for the buffer decoders
+    reference = io.BytesIO()
+    yaz0.decompress(io.BytesIO(compressed), reference)
+
+    if python != data or reference.getvalue() != python:
+        return "decoding"
+    if native and decompress_buffer_native(compressed) != python:
+        return "decoding"
+
+    return None
+
+
+def check(inputs, levels, native=True):
+    # Compare the backends against each other, returns a MismatchReport.
+    from .check_report import MismatchReport
+
+    report = MismatchReport()
+
+    for name, data in inputs:
+        for level in levels:
+            mismatch = find_mismatch(data, level, native)
+            if report.check(mismatch is None, "{0} {1} at level {2}".format(mismatch, name, level)):
+                print("OK: {0} at level {1}, {2} bytes".format(name, level, len(data)))
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(
+        description="Build the native Yaz0 library or check that it matches the Python implementation "
+                    "and the reference decoder.")
+    parser.add_argument("--cc", default=None,
+                        help="C compiler to use. Default: $CC or cc")
+    parser.add_argument("--check", action="store_true",
+                        help="Check that both backends produce identical output instead of building. "
+                             "Without the built library only the Python backend is checked")
+    parser.add_argument("files", nargs="*",
+                        help="Files used for --check. Generated test data is used if none are given.")
+
+    args = parser.parse_args()
+
+    if not args.check:
+        build(args.cc)
+        print("Built", LIBRARY_PATH)
+    else:
+        try:
+            load()
+            native = True
+        except OSError:
+            print("Native library {0} isn't built, only checking the Python implementation".format(LIBRARY_PATH))
+            native = False
+
+        if args.files:
+            inputs = []
+            for path in args.files:
+                with open(path, "rb") as f:
+                    inputs.append((path, f.read()))
+        else:
+            rng = random.Random(0)
+            words = [b"teki", b"pelt", b"item", b"{v0.3}", b" 0.000000", b"\n\t"]
+            inputs = [
+                ("empty", b""),
+                ("one", b"a"),
+                ("short", b"ab"),
+                ("seven", b"abcabca"),
+                ("nine", b"\x00"*9),
+                ("odd repeated", b"ab"*501),
+                ("repeated", b"\x00"*5000),
+                ("random", bytes(rng.getrandbits(8) for i in range(20000))),
+                ("text", b"".join(rng.choice(words) for i in range(20000)))
+            ]
+
+        from .yaz0 import COMPRESSION_LEVELS
+        check(inputs, sorted(COMPRESSION_LEVELS.keys()), native).exit("inputs and levels")
@@ -5,7 +5,139 @@ from timeit import default_timer
 from pikmingen import PikminObject, TextRoot, TextNode
 
 
-def parse_structure(f, depth=0, brackets=0):
+def iter_structure(f, brackets=0, comments=None, yield_unclosed=True):
+    """Parse a text file and yield its top level entries one at a time.
+
+    Blocks are yielded as TextNodes once they are closed, a block that is still open
+    at the end of the file only if yield_unclosed is set. Nested blocks are kept on an
+    explicit stack instead of recursing. The generator returns the amount of brackets
+    that were opened but not closed, negative if there were more closing brackets.
+
+    If comments is a list, the comment lines in front of every block are collected in
+    the same pass, with the same rules as gen_readcomments: one list of comments is
+    appended for every line that starts with { and doesn't contain }.
+    """
+    stack = []
+
+    collect_comments = comments is not None
+    started = False
+    current_comment = []
+    addcomments = True
+
+    for line in f:
+        if collect_comments:
+            if not started:
+                started = line.startswith("{")
+            else:
+                if line.startswith("#") and addcomments:
+                    current_comment.append(line.strip())
+
+                if line.startswith("{") and "}" not in line:
+                    comments.append(current_comment)
+                    current_comment = []
+                    addcomments = False
+
+                if line.startswith("}"):
+                    addcomments = True
+
+        line = line.partition("#")[0].strip()
+
+        if line == "":
+            continue
+        elif line == "{":
+            nested_data = TextNode()
+            if stack:
+                stack[-1].append(nested_data)
+            stack.append(nested_data)
+            brackets += 1
+            continue
+        elif line == "}":
+            close = True
+        else:
+            values = line.split(" ")
+
+            # This is a hack for an oddity in pikmin 2 initgen files where there's
+            # a closing bracket on the same line as a line of data.
+            close = values[-1].strip() == "}" and "{" not in line
+            if close:
+                values.pop()
+
+            if len(values) == 1:
+                value = values[0]
+            else:
+                value = values
+
+            if stack:
+                stack[-1].append(value)
+            else:
+                yield value
+
+        if close:
+            brackets -= 1
+            if not stack:
+                # Closing bracket at the top level, from_file reports the mismatch
+                break
+
+            nested_data = stack.pop()
+            if not stack:
+                yield nested_data
+
+    # Block that wasn't closed at the end of the file
+    if stack and yield_unclosed:
+        yield stack[0]
+
+    return brackets
+
+
+def parse_structure(f, depth=0, brackets=0, comments=None):
+    """Parse the nested {} blocks of a text file into TextNodes, see iter_structure.
+
+    Returns the root node and the amount of brackets that were opened but not closed.
+    The result is the same as the one of parse_structure_recursive.
+    """
+    data = TextNode()
+    entries = iter_structure(f, brackets, comments)
+
+    while True:
+        try:
+            data.append(next(entries))
+        except StopIteration as result:
+            return data, result.value
+
+
+def iter_objects(f):
+    """Yield the generators of a gen file one at a time as PikminObjects.
+
+    Only the generator that is being parsed is kept in memory and the caller can stop
+    at any point. The header (version, start position, start direction and generator
+    count) is skipped.
+    """
+    comments = []
+    entries = iter_structure(f, comments=comments, yield_unclosed=False)
+    header = 4
+
+    while True:
+        try:
+            entry = next(entries)
+        except StopIteration as result:
+            if result.value != 0:
+                raise RuntimeError("Syntax error: the amount of opening and closing brackets doesn't match.")
+            return
+
+        if header > 0:
+            header -= 1
+            continue
+
+        pikminobject = PikminObject()
+        pikminobject.from_textnode(entry)
+        if comments:
+            pikminobject.set_preceeding_comment(comments.pop(0))
+
+        yield pikminobject
+
+
+# Recursive parser that was used before parse_structure, kept for checking that both give the same result
+def parse_structure_recursive(f, depth=0, brackets=0):
     data = TextNode()
     started = False
     for line in f:
@@ -19,7 +151,7 @@ def parse_structure(f, depth=0, brackets=0):
 
         if line == "{":
             started = True
-            nested_data, brackets = TextNode(parse_structure(f, depth+1, brackets+1))
+            nested_data, brackets = TextNode(parse_structure_recursive(f, depth+1, brackets+1))
             data.append(nested_data)
         elif line == "}":
             brackets -= 1
@@ -48,6 +180,65 @@ def parse_structure(f, depth=0, brackets=0):
     return data, brackets
 
 
+def same_structure(a, b):
+    # Like ==, but the types of all nodes have to match as well
+    if type(a) is not type(b):
+        return False
+    elif isinstance(a, list):
+        return len(a) == len(b) and all(same_structure(x, y) for x, y in zip(a, b))
+    else:
+        return a == b
+
+
+def check_parsers(text):
+    # Differential check of parse_structure against the old recursive parser
+    new_data, new_brackets = parse_structure(StringIO(text))
+    old_data, old_brackets = parse_structure_recursive(StringIO(text))
+
+    return new_brackets == old_brackets and same_structure(new_data, old_data)
+
+
+def generate_check_text(rng, lines=200):
+    # Random text with the odd cases the parser has to handle the same way as before
+    choices = ["{", "{", "}", "}", "{v0.3}", "1 2 3", "0.000000 1.000000 -2.500000", "a  b", "item }",
+               "a b }", "} }", "{ a", "\t# comment", "x # comment { }", "", "   ", "{item} {0002}", "\t\t5",
+               "a\t}", "}# comment", "\u3000"]
+
+    return "\n".join(rng.choice(choices) for i in range(rng.randint(0, lines)))
+
+
+def serialize_node(node, depth, indent_char, lines):
+    # Appends the lines of all entries in node to lines, used by PikminTxt.write
+    indent = depth*indent_char
+    append = lines.append
+
+    for item in node:
+        if type(item) is str:
+            append(indent+item+"\n")
+        elif isinstance(item, TextNode):
+            append(indent+"{\n")
+            serialize_node(item, depth+1, indent_char, lines)
+            append(indent+"}\n")
+        elif isinstance(item, list):
+            # Every value is followed by a space, including the last one
+            if not item:
+                append(indent+"\n")
+                continue
+
+            try:
+                # Parsed files only contain strings
+                line = " ".join(item)
+            except TypeError:
+                for x in item:
+                    if isinstance(x, list):
+                        raise RuntimeError("This shouldn't happen: {} is a list".format(x))
+                line = " ".join(map(str, item))
+
+            append(indent+line+" \n")
+        else:
+            append(indent+str(item)+"\n")
+
+
 def stringify(x):
     if isinstance(x, list):
         return " ".join(x)
@@ -60,8 +251,8 @@ class PikminTxt(object):
     def __init__(self):
         self._root = TextRoot()
 
-    def from_file(self, f):
-        self._root, brackets = TextRoot(parse_structure(f, depth=0))
+    def from_file(self, f, comments=None):
+        self._root, brackets = parse_structure(f, comments=comments)
         if brackets != 0:
             raise RuntimeError("Syntax error: the amount of opening and closing brackets doesn't match.")
 
@@ -73,24 +264,11 @@ class PikminTxt(object):
         if node is None:
             node = self._root
 
-        for item in node:
-            if isinstance(item, TextNode):
-                f.write(depth*indent_char+"{\n")
-                PikminTxt.write(self, f, item, depth=depth+1, indent_char=indent_char)
-                f.write(depth*indent_char+"}\n")
-            else:
-                f.write(depth*indent_char)
-                if isinstance(item, list):
-                    for x in item:
-                        if isinstance(x, list):
-                            raise RuntimeError("This shouldn't happen: {} is a list".format(x))
-                        else:
-                            f.write(str(x))
-                            f.write(" ")
-                    #f.write(" ".join(stringify(x) for x in item))
-                else:
-                    f.write(str(item))
-                f.write("\n")
+        # Every top level entry is built as a list of lines and written at once
+        for i in range(len(node)):
+            lines = []
+            serialize_node(node[i:i+1], depth, indent_char, lines)
+            f.write("".join(lines))
 
 # Parser/writer for waterbox.txt files.
 # Every entry in WaterboxTxt.waterboxes is x1,y1,z1, x2,y2,z2 specifying
@@ -269,15 +447,37 @@ class PikminGenFile(PikminTxt):
         self.startdir = 0.0
 
         self.objects = []
+        self._columns = None
 
     def remove_object(self, pikminobj):
         self.objects.remove(pikminobj)
+        self._columns = None
 
     def add_object(self, pikminobj):
         self.objects.append(pikminobj)
+        self._columns = None
+
+    def get_columns(self):
+        """Return the ObjectColumns of the objects, see gencolumns.py. They are created on the
+        first call and again after objects were added, removed or invalidate_columns() was
+        called. Returns None if NumPy isn't installed."""
+        # Imported here so scripts that don't need the columns don't import NumPy
+        import gencolumns
+        if not gencolumns.is_available():
+            return None
+
+        if self._columns is None or not self._columns.is_current(self.objects):
+            self._columns = gencolumns.ObjectColumns(self.objects)
+
+        return self._columns
+
+    def invalidate_columns(self):
+        self._columns = None
 
     def from_file(self, f):
-        super().from_file(f)
+        # Comments are collected while parsing so f is only read once and doesn't need to be seekable
+        allcomments = []
+        super().from_file(f, allcomments)
 
         self.version = self._root[0]
 
@@ -298,13 +498,22 @@ class PikminGenFile(PikminTxt):
                 pikminobject.from_textnode(generator)
                 self.objects.append(pikminobject)
 
-        f.seek(0)
-        allcomments = gen_readcomments(f)
         assert len(allcomments) == len(self.objects)
         for i, val in enumerate(allcomments):
             if val is not None:
                 self.objects[i].set_preceeding_comment(val)
 
+    def from_path(self, path, use_cache=True, encoding="shift_jis-2004", errors="backslashreplace"):
+        """Load the gen file at path. With use_cache the binary cache next to it is used
+        if it is up to date and created otherwise, see gencache.py."""
+        if use_cache:
+            # Imported here because gencache imports this module
+            import gencache
+            gencache.load_gen_file(self, path, encoding, errors)
+        else:
+            with open(path, "r", encoding=encoding, errors=errors) as f:
+                self.from_file(f)
+
     def write(self, f, *args, **kwargs):
         del self._root
         self._root = TextRoot()
@@ -349,13 +558,44 @@ def gen_readcomments(f):
 
 
 if __name__ == "__main__":
+    import argparse
     import os
-    # import pprint
+    import random
+
+    from lib.check_report import MismatchReport
+
+    parser = argparse.ArgumentParser(
+        description="Parse and write gen files again, or check the parser against the old recursive parser.")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check that both parsers give the same result. Generated text is used if no files are given.")
+    parser.add_argument("files", nargs="*",
+                        help="Gen files to parse. Default: initgen.txt, defaultgen.txt and plantsgen.txt in examples")
+
+    args = parser.parse_args()
+
+    if args.check:
+        if args.files:
+            texts = []
+            for input_path in args.files:
+                with open(input_path, "r", encoding="shift-jis") as f:
+                    texts.append((input_path, f.read()))
+        else:
+            rng = random.Random(0)
+            texts = [("generated {0}".format(i), generate_check_text(rng)) for i in range(2000)]
+
+        report = MismatchReport()
+        for name, text in texts:
+            report.check(check_parsers(text), name)
+
+        report.exit()
+
+    input_paths = args.files
+    if not input_paths:
+        input_paths = [os.path.join("examples", name) for name in ("initgen.txt", "defaultgen.txt", "plantsgen.txt")]
 
     pikmintext = PikminGenFile()
 
-    for name in ("initgen.txt", "defaultgen.txt", "plantsgen.txt"):
-        input_path = os.path.join("examples", name)
+    for input_path in input_paths:
         output_path = input_path+"new.txt"
 
         with open(input_path, "r", encoding="shift-jis") as f:
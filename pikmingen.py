@@ -1,10 +1,10 @@
-import json
-from copy import deepcopy
+from array import array
 from struct import pack
 from itertools import chain
 from io import StringIO
+from functools import partial
 
-import libpiktxt
+import entities
 
 
 
@@ -31,25 +31,202 @@ BRIDGES = {"0": BRIDGE_SHORT,
 GATE_SAND = "Gate"
 GATE_ELECTRIC = "Electric Gate"
 
-with open("resources/entities.json", "r") as f:
-    ENTITY_DICT = json.load(f)
+# The names in entities.json are loaded on first use, see entities.py.
+# TEKIS, TREASURES and EXPKIT_TREASURES are still available as module attributes.
+ENTITY_TABLES = {"TEKIS": "teki",
+                 "TREASURES": "treasures",
+                 "EXPKIT_TREASURES": "expkit_treasures"}
+
+
+def __getattr__(name):
+    if name in ENTITY_TABLES:
+        return entities.get_table(ENTITY_TABLES[name])
+    elif name == "ENTITY_DICT":
+        return entities.get_entities()
+
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def copy_tree(node):
+    # Copies the nested lists of a parsed text tree and keeps their types (TextNode or list),
+    # the strings in them are immutable and shared with the original.
+    copied = [copy_tree(value) if isinstance(value, list) else value for value in node]
+    if node.__class__ is list:
+        return copied
+    else:
+        return node.__class__(copied)
+
+
+# Kinds of objects that are drawn or handled differently. Every object gets one of these
+# together with its display name, see PikminObject.update_useful_name.
+KIND_OTHER = 0
+KIND_ROCKET = 1
+KIND_REDONION = 2
+KIND_YELLOWONION = 3
+KIND_BLUEONION = 4
+KIND_BRIDGE_SHORT = 5
+KIND_BRIDGE_SHORT_UP = 6
+KIND_BRIDGE_LONG = 7
+KIND_GATE = 8
+KIND_ELECTRIC_GATE = 9
+KIND_SMALL_BLOCK = 10
+KIND_NORMAL_BLOCK = 11
+KIND_PAPER_BAG = 12
+KIND_PLANT = 13
+KIND_TEKI = 14
+KIND_PELLET = 15
+KIND_TREASURE = 16
+KIND_EXPKIT_TREASURE = 17
+
+ONIONS = {"4": (KIND_ROCKET, ONYN_ROCKET),
+          "2": (KIND_YELLOWONION, ONYN_YELLOWONION),
+          "1": (KIND_REDONION, ONYN_REDONION),
+          "0": (KIND_BLUEONION, ONYN_BLUEONION)}
+
+BRIDGE_KINDS = {"0": KIND_BRIDGE_SHORT,
+                "1": KIND_BRIDGE_SHORT_UP,
+                "2": KIND_BRIDGE_LONG}
+
+DOWNFLOORS = {"0": (KIND_SMALL_BLOCK, "Small Block"),
+              "1": (KIND_NORMAL_BLOCK, "Normal Block"),
+              "2": (KIND_PAPER_BAG, "Paper Bag")}
+DOWNFLOOR_SUFFIXES = {"0": "", "1": " [Seesaw]"}
+
+PLANT_SUFFIXES = {"0": " (Red Berry)",
+                  "1": " (Purple Berry)",
+                  "2": " (Mixed)"}
+
+PELLETS = {"0": "Blue Pellet",
+           "1": "Red Pellet",
+           "2": "Yellow Pellet"}
+
+
+def lookup(table, key, default=None):
+    # In malformed files a value can be a list, which can't be used as a key
+    if isinstance(key, str):
+        return table.get(key, default)
+    else:
+        return default
+
+
+def classify_onion(pikminobject, itemdata):
+    onion = lookup(ONIONS, itemdata[3])
+    if onion is not None:
+        return onion
+    else:
+        return KIND_OTHER, pikminobject.object_type+itemdata[0]
+
+
+def classify_bridge(pikminobject, itemdata):
+    bridgetype = itemdata[3]
+    if bridgetype in BRIDGES:
+        return BRIDGE_KINDS[bridgetype], BRIDGES[bridgetype]
+    else:
+        return KIND_OTHER, "<unknown bridge type:{0}>".format(bridgetype)
+
+
+def classify_downfloor(pikminobject, itemdata):
+    downfloor = lookup(DOWNFLOORS, itemdata[4])
+    if downfloor is not None:
+        kind, name = downfloor
+        return kind, name + lookup(DOWNFLOOR_SUFFIXES, itemdata[5], " [Invalid]")
+    else:
+        return KIND_OTHER, "Invalid dwfl"
+
+
+def classify_plant(pikminobject, itemdata):
+    return KIND_PLANT, "Burg. Spiderwort" + lookup(PLANT_SUFFIXES, itemdata[3], " (Invalid)")
+
+
+ITEM_CLASSIFIERS = {
+    "{onyn}": classify_onion,
+    "{brdg}": classify_bridge,
+    "{gate}": lambda pikminobject, itemdata: (KIND_GATE, GATE_SAND),
+    "{dgat}": lambda pikminobject, itemdata: (KIND_ELECTRIC_GATE, GATE_ELECTRIC),
+    "{dwfl}": classify_downfloor,
+    "{plnt}": classify_plant
+}
+
+
+def classify_item(pikminobject):
+    itemdata = pikminobject._object_data[0]
+    subtype = itemdata[0]
+
+    classify = lookup(ITEM_CLASSIFIERS, subtype)
+    if classify is not None:
+        return classify(pikminobject, itemdata)
+    else:
+        return KIND_OTHER, pikminobject.object_type+subtype
+
+
+def get_entity_name(table, prefix, unknown, identifier):
+    names = entities.get_table(table)
+    if identifier in names:
+        return prefix+names[identifier]
+    else:
+        return unknown.format(identifier)
+
+
+def classify_teki(pikminobject):
+    # The names from entities.json are looked up when the name is needed for the first time,
+    # see PikminObject.get_useful_object_name
+    identifier = pikminobject.identifier_misc[1][1:]
+    return KIND_TEKI, partial(get_entity_name, "teki", "Teki: ", "Unknown Teki: {0}", identifier)
 
-TEKIS = ENTITY_DICT["teki"]
-#BRIDGES = ENTITY_DICT["bridges"]
-TREASURES = ENTITY_DICT["treasures"]
-EXPKIT_TREASURES = ENTITY_DICT["expkit_treasures"]
+
+def classify_pelt(pikminobject):
+    mgrid = pikminobject._object_data[0][0]
+
+    if mgrid == "0":
+        treasureid = pikminobject._object_data[0][3]
+        if isinstance(treasureid, list):
+            return KIND_PELLET, lookup(PELLETS, treasureid[0], "Unknown Pellet")
+        else:
+            return KIND_PELLET, "Invalid Pellet"
+    elif mgrid == "3":
+        treasureid = pikminobject._object_data[0][3]
+        return KIND_TREASURE, partial(get_entity_name, "treasures", "Treasure: ", "Unknown treasure: {0}",
+                                      treasureid)
+    elif mgrid == "4":
+        treasureid = pikminobject._object_data[0][3]
+        return KIND_EXPKIT_TREASURE, partial(get_entity_name, "expkit_treasures", "ExpKit Treasure: ",
+                                             "Unknown exploration kit treasure: {0}", treasureid)
+    else:
+        return KIND_OTHER, pikminobject.object_type
+
+
+TYPE_CLASSIFIERS = {
+    "{item}": classify_item,
+    "{teki}": classify_teki,
+    "{pelt}": classify_pelt
+}
 
 
 def assert_notlist(val):
     assert not isinstance(val, list)
 
 
+def make_arguments(values):
+    # The 32 arguments are bytes, they are only kept as a list if a value doesn't fit
+    values = [int(x) for x in values]
+    try:
+        return array("B", values)
+    except OverflowError:
+        return values
+
+
 class PikminObject(object):
+    # Maps can have thousands of objects, without __dict__ they need a lot less memory
+    __slots__ = ("version", "reserved", "days_till_resurrection", "arguments",
+                 "position_x", "position_y", "position_z", "offset_x", "offset_y", "offset_z", "x", "y", "z",
+                 "object_type", "identifier", "identifier_misc", "_object_data", "preceeding_comment",
+                 "_rotation", "_horizontal_rotation", "_kind", "_useful_name")
+
     def __init__(self):
         self.version = "{v0.3}"
         self.reserved = 0
         self.days_till_resurrection = 0
-        self.arguments = [0 for i in range(32)]
+        self.arguments = array("B", bytes(32))
 
         self.position_x = self.position_y = self.position_z = 0.0
         self.offset_x = self.offset_y = self.offset_z = 0.0
@@ -61,11 +238,16 @@ class PikminObject(object):
         self._object_data = TextNode()
         self.preceeding_comment = []
 
+        self._rotation = None
         self._horizontal_rotation = None
 
+        self._kind = KIND_OTHER
         self._useful_name = "None"
 
     def from_text(self, text):
+        # Imported here because libpiktxt imports this module
+        import libpiktxt
+
         node = libpiktxt.PikminTxt()
         node.from_text(text)
 
@@ -84,17 +266,14 @@ class PikminObject(object):
                 break
 
         self.set_preceeding_comment(comments)
-        if self.get_rotation() is not None:
-            self._horizontal_rotation = float(self.get_rotation()[1])
-        else:
-            self._horizontal_rotation = None
+        self.update_rotation()
         self.update_useful_name()
 
     def from_textnode(self, textnode):
         self.version = textnode[0]  # Always v0.3?
         self.reserved = int(textnode[1])  # Unknown
         self.days_till_resurrection = int(textnode[2])  # Probably how many days till an object reappears.
-        self.arguments = [int(x) for x in textnode[3]]  # 32 byte shift-jis encoded identifier string
+        self.arguments = make_arguments(textnode[3])  # 32 byte shift-jis encoded identifier string
         self.position_x, self.position_y, self.position_z = map(float, textnode[4])  # XYZ Position
         self.offset_x, self.offset_y, self.offset_z = map(float, textnode[5])  # XYZ offset
 
@@ -107,10 +286,7 @@ class PikminObject(object):
         self.identifier_misc = textnode[6][1:]  # Sometimes just a 4 digit number with preceeding
 
         self._object_data = textnode[7:]  # All the remaining data, differs per object type
-        if self.get_rotation() is not None:
-            self._horizontal_rotation = float(self.get_rotation()[1])
-        else:
-            self._horizontal_rotation = None
+        self.update_rotation()
         #print("Object", self.identifier, "with position", self.position_x, self.position_y, self.position_z)
         self.update_useful_name()
 
@@ -137,19 +313,53 @@ class PikminObject(object):
 
         self._object_data = other_pikminobj._object_data
         self.set_preceeding_comment(other_pikminobj.preceeding_comment)
-
-        if self.get_rotation() is not None:
-            self._horizontal_rotation = float(self.get_rotation()[1])
-        else:
-            self._horizontal_rotation = None
+        self.update_rotation()
         self.update_useful_name()
 
     def copy(self):
-        #newobj = PikminObject()
-        #newobj.from_pikmin_object(self)
-        return deepcopy(self)#newobj
+        # Copying field by field is a lot faster than deepcopy, which goes through its memo
+        # for every node and string of _object_data.
+        newobj = PikminObject.__new__(PikminObject)
+        newobj.version = self.version
+        newobj.reserved = self.reserved
+        newobj.days_till_resurrection = self.days_till_resurrection
+        newobj.arguments = self.arguments[:]
+
+        newobj.position_x, newobj.position_y, newobj.position_z = self.position_x, self.position_y, self.position_z
+        newobj.offset_x, newobj.offset_y, newobj.offset_z = self.offset_x, self.offset_y, self.offset_z
+        newobj.x, newobj.y, newobj.z = self.x, self.y, self.z
+
+        newobj.object_type = self.object_type
+        newobj.identifier = self.identifier
+        if isinstance(self.identifier_misc, list):
+            newobj.identifier_misc = copy_tree(self.identifier_misc)
+        else:
+            newobj.identifier_misc = self.identifier_misc
+        newobj._object_data = copy_tree(self._object_data)
+        newobj.preceeding_comment = list(self.preceeding_comment)
+
+        # The cached values are immutable
+        newobj._rotation = self._rotation
+        newobj._horizontal_rotation = self._horizontal_rotation
+        newobj._kind = self._kind
+        newobj._useful_name = self._useful_name
+
+        return newobj
 
     def get_rotation(self):
+        return self._rotation
+
+    def update_rotation(self):
+        # The rotation stays as text in _object_data so it is written back unchanged,
+        # the values are only converted to floats here.
+        self._rotation = self._parse_rotation()
+
+        if self._rotation is not None:
+            self._horizontal_rotation = self._rotation[1]
+        else:
+            self._horizontal_rotation = None
+
+    def _parse_rotation(self):
         if self.object_type == "{item}":
             itemdata = self._object_data[0]
 
@@ -165,113 +375,27 @@ class PikminObject(object):
             return None
 
     def update_useful_name(self):
-        self._useful_name = self._get_useful_object_name()
+        # The kind and the name only depend on the object data, so they are worked out once
+        # here instead of every time the object is drawn or listed. Names of tekis and
+        # treasures are a function until they are needed, so loading a file doesn't load
+        # entities.json.
+        self._kind, self._useful_name = self._classify()
 
     def get_useful_object_name(self):
-        return self._useful_name
-
-    def _get_useful_object_name(self):
-        if self.object_type == "{item}":
-            itemdata = self._object_data[0]
-            subtype = itemdata[0]
-
-            if subtype == "{onyn}":
-                oniontype = itemdata[3]
-                if oniontype == "4":
-                    return ONYN_ROCKET
-                elif oniontype == "2":
-                    return ONYN_YELLOWONION
-                elif oniontype == "1":
-                    return ONYN_REDONION
-                elif oniontype == "0":
-                    return ONYN_BLUEONION
-
-            elif subtype == "{brdg}":
-                bridgetype = itemdata[3]
-                if bridgetype in BRIDGES:
-                    return BRIDGES[bridgetype]
-                else:
-                    return "<unknown bridge type:{0}>".format(bridgetype)
-            elif subtype == "{gate}":
-                return GATE_SAND
-            elif subtype == "{dgat}":
-                return GATE_ELECTRIC
-            elif subtype == "{dwfl}":
-                blocktype = itemdata[4]
-                is_seesaw = itemdata[5]
-                suffix = ""
-
-                if is_seesaw == "1":
-                    suffix = " [Seesaw]"
-                elif is_seesaw != "0":
-                    suffix = " [Invalid]"
-
-                if blocktype == "0":
-                    return "Small Block"+suffix
-                elif blocktype == "1":
-                    return "Normal Block"+suffix
-                elif blocktype == "2":
-                    return "Paper Bag"+suffix
-                else:
-                    return "Invalid dwfl"
-            elif subtype == "{plnt}":
-                name = "Burg. Spiderwort"
-                planttype = itemdata[3]
-                if planttype == "0":
-                    name += " (Red Berry)"
-                elif planttype == "1":
-                    name += " (Purple Berry)"
-                elif planttype == "2":
-                    name += " (Mixed)"
-                else:
-                    name += " (Invalid)"
-
-                return name
+        if not isinstance(self._useful_name, str):
+            self._useful_name = self._useful_name()
 
-            return self.object_type+subtype
-
-        elif self.object_type == "{teki}":
-            identifier = self.identifier_misc[1][1:]
-            if identifier in TEKIS:
-                return "Teki: "+TEKIS[identifier]
-            else:
-                return "Unknown Teki: {0}".format(identifier)
-
-        elif self.object_type == "{pelt}":
-            mgrid = self._object_data[0][0]
-
-            if mgrid == "0":
-                treasureid = self._object_data[0][3]
-                if isinstance(treasureid, list):
-                    pellet_type = treasureid[0]
-
-                    if pellet_type == "0":
-                        return "Blue Pellet"
-                    elif pellet_type == "1":
-                        return "Red Pellet"
-                    elif pellet_type == "2":
-                        return "Yellow Pellet"
-                    else:
-                        return "Unknown Pellet"
-                else:
-                    return "Invalid Pellet"
+        return self._useful_name
 
-            if mgrid == "3":
-                treasureid = self._object_data[0][3]
-                if treasureid in TREASURES:
-                    return "Treasure: "+TREASURES[treasureid]
-                else:
-                    return "Unknown treasure: {0}".format(treasureid)
-            elif mgrid == "4":
-                treasureid = self._object_data[0][3]
-                if treasureid in EXPKIT_TREASURES:
-                    return "ExpKit Treasure: "+EXPKIT_TREASURES[treasureid]
-                else:
-                    return "Unknown exploration kit treasure: {0}".format(treasureid)
-            return self.object_type
+    def get_kind(self):
+        return self._kind
 
+    def _classify(self):
+        classify = lookup(TYPE_CLASSIFIERS, self.object_type)
+        if classify is not None:
+            return classify(self)
         else:
-            return self.object_type
+            return KIND_OTHER, self.object_type
 
     def get_horizontal_rotation(self):
         """if self.object_type == "{item}":
@@ -290,19 +414,16 @@ class PikminObject(object):
             for i, val in enumerate(rotation):
                 if val is not None:
                     itemdata[1][i] = val
-                    if i == 1:
-                        self._horizontal_rotation = float(val)
 
         elif self.object_type == "{teki}":
             self._object_data[2] = rotation[1]
-            self._horizontal_rotation = float(rotation[1])
         elif self.object_type == "{pelt}":
             peltdata = self._object_data[0]
             for i, val in enumerate(rotation):
                 if val is not None:
                     peltdata[1][i] = val
-                    if i == 1:
-                        self._horizontal_rotation = float(val)
+
+        self.update_rotation()
 
     def set_preceeding_comment(self, comments):
         self.preceeding_comment = comments
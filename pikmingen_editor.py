@@ -15,6 +15,7 @@ import opengltext
 import py_obj
 from lib.model_rendering import Waterbox
 from libpiktxt import PikminGenFile, WaterboxTxt
+import gencolumns
 from custom_widgets import catch_exception
 from pikmingen import PikminObject
 from configuration import read_config, make_default_config, save_cfg
@@ -22,7 +23,8 @@ from configuration import read_config, make_default_config, save_cfg
 import pikmingen_widgets as pikwidgets
 from pikmingen_widgets import (GenMapViewer, PikminSideWidget, PikObjectEditor, open_error_dialog,
                                catch_exception_with_dialog)
-from lib.rarc import Archive
+from lib.rarc import Archive, set_archive_cache
+from lib.archive_cache import ArchiveCache, DEFAULT_PATH
 
 PIKMIN2GEN = "Generator files (defaultgen.txt;initgen.txt;plantsgen.txt;*.txt)"
 
@@ -296,7 +298,7 @@ class GenEditor(QMainWindow):
             if choosentype == "Archived waterbox.txt (*.szs,*.arc)" \
                     or filepath.endswith(".szs") or filepath.endswith(".arc"):
                 with open(filepath, "rb") as f:
-                    archive = Archive.from_file(f)
+                    archive = Archive.from_file(f, lazy=True)
                     #try:
                     f = archive["text/waterbox.txt"]
                     #print(f.read())
@@ -331,16 +333,15 @@ class GenEditor(QMainWindow):
             print("Reset done")
             print("Chosen file type:", choosentype)
 
-            with open(filepath, "r", encoding="shift_jis-2004", errors="backslashreplace") as f:
-                try:
-                    pikmin_gen_file = PikminGenFile()
-                    pikmin_gen_file.from_file(f)
-                    self.setup_gen_file(pikmin_gen_file, filepath)
+            try:
+                pikmin_gen_file = PikminGenFile()
+                pikmin_gen_file.from_path(filepath)
+                self.setup_gen_file(pikmin_gen_file, filepath)
 
-                except Exception as error:
-                    print("Error appeared while loading:", error)
-                    traceback.print_exc()
-                    open_error_dialog(str(error), self)
+            except Exception as error:
+                print("Error appeared while loading:", error)
+                traceback.print_exc()
+                open_error_dialog(str(error), self)
 
     def setup_gen_file(self, pikmin_gen_file, filepath):
         self.pikmin_gen_file = pikmin_gen_file
@@ -430,7 +431,7 @@ class GenEditor(QMainWindow):
 
                 with open(filepath, "rb") as f:
                     if load_from_arc:
-                        archive = Archive.from_file(f)
+                        archive = Archive.from_file(f, lazy=True)
                         f = archive["text/grid.bin"]
                     collision = py_obj.PikminCollision(f)
 
@@ -524,7 +525,7 @@ class GenEditor(QMainWindow):
                     newobj.y = newobj.position_y = round(y, 6)
                     newobj.offset_y = 0
 
-        self.pikmin_gen_file.objects.append(newobj)
+        self.pikmin_gen_file.add_object(newobj)
         #self.pikmin_gen_view.update()
         self.pikmin_gen_view.do_redraw()
 
@@ -540,7 +541,7 @@ class GenEditor(QMainWindow):
         newobj.position_z = newobj.z = round(z, 6)
         newobj.offset_x = newobj.offset_y = newobj.offset_z = 0.0
 
-        self.pikmin_gen_file.objects.append(newobj)
+        self.pikmin_gen_file.add_object(newobj)
         # self.pikmin_gen_view.update()
         self.pikmin_gen_view.do_redraw()
 
@@ -570,22 +571,30 @@ class GenEditor(QMainWindow):
 
     @catch_exception
     def action_move_objects(self, deltax, deltaz):
-        for obj in self.pikmin_gen_view.selected:
-            obj.x += deltax
-            obj.z += deltaz
-            obj.x = round(obj.x, 6)
-            obj.z = round(obj.z, 6)
-            obj.position_x = obj.x
-            obj.position_z = obj.z
-            obj.offset_x = 0
-            obj.offset_z = 0
-
-            if self.editorconfig.getboolean("GroundObjectsWhenMoving") is True:
-                if self.pikmin_gen_view.collision is not None:
+        columns = self.pikmin_gen_file.get_columns()
+        if columns is not None:
+            columns.move(self.pikmin_gen_view.selected, deltax, deltaz)
+        else:
+            for obj in self.pikmin_gen_view.selected:
+                obj.x += deltax
+                obj.z += deltaz
+                obj.x = round(obj.x, 6)
+                obj.z = round(obj.z, 6)
+                obj.position_x = obj.x
+                obj.position_z = obj.z
+                obj.offset_x = 0
+                obj.offset_z = 0
+
+        if self.editorconfig.getboolean("GroundObjectsWhenMoving") is True:
+            if self.pikmin_gen_view.collision is not None:
+                for obj in self.pikmin_gen_view.selected:
                     y = self.pikmin_gen_view.collision.collide_ray_downwards(obj.x, obj.z)
                     obj.y = obj.position_y = round(y, 6)
                     obj.offset_y = 0
 
+                if columns is not None:
+                    columns.update(self.pikmin_gen_view.selected)
+
         if len(self.pikmin_gen_view.selected) == 1:
             obj = self.pikmin_gen_view.selected[0]
             self.pik_control.set_info(obj, (obj.x, obj.y, obj.z), obj.get_rotation())
@@ -597,11 +606,15 @@ class GenEditor(QMainWindow):
 
     @catch_exception
     def action_change_object_heights(self, deltay):
-        for obj in self.pikmin_gen_view.selected:
-            obj.y += deltay
-            obj.y = round(obj.y, 6)
-            obj.position_y = obj.y
-            obj.offset_y = 0
+        columns = self.pikmin_gen_file.get_columns()
+        if columns is not None:
+            columns.change_heights(self.pikmin_gen_view.selected, deltay)
+        else:
+            for obj in self.pikmin_gen_view.selected:
+                obj.y += deltay
+                obj.y = round(obj.y, 6)
+                obj.position_y = obj.y
+                obj.offset_y = 0
 
         if len(self.pikmin_gen_view.selected) == 1:
             obj = self.pikmin_gen_view.selected[0]
@@ -668,6 +681,9 @@ class GenEditor(QMainWindow):
 
     def action_rotate_object(self, obj, angle):
         obj.set_rotation((None, round(angle, 6), None))
+        columns = self.pikmin_gen_file.get_columns()
+        if columns is not None:
+            columns.update((obj,))
         self.pik_control.set_info(obj, (obj.x, obj.y, obj.z), obj.get_rotation())
 
         #self.pikmin_gen_view.update()
@@ -675,20 +691,24 @@ class GenEditor(QMainWindow):
         self.set_has_unsaved_changes(True)
 
     def action_ground_objects(self):
-        for obj in self.pikmin_gen_view.selected:
-            if self.pikmin_gen_view.collision is None:
-                return None
-            height = self.pikmin_gen_view.collision.collide_ray_downwards(obj.x, obj.z)
+        selected = self.pikmin_gen_view.selected
+        if len(selected) == 0:
+            columns = None
+        elif self.pikmin_gen_view.collision is None:
+            return None
+        else:
+            columns = self.pikmin_gen_file.get_columns()
 
-            if height is not None:
-                if obj.object_type == "{item}":
-                    if obj.get_useful_object_name().startswith("Small Block")\
-                            or obj.get_useful_object_name().startswith("Normal Block")\
-                            or obj.get_useful_object_name().startswith("Paper Bag"):
-                        height += 45.0
+        if columns is not None:
+            columns.ground(selected, self.pikmin_gen_view.collision)
+        else:
+            for obj in selected:
+                height = self.pikmin_gen_view.collision.collide_ray_downwards(obj.x, obj.z)
 
-                obj.position_y = obj.y = round(height, 6)
-                obj.offset_y = 0.0
+                if height is not None:
+                    height += gencolumns.get_ground_offset(obj)
+                    obj.position_y = obj.y = round(height, 6)
+                    obj.offset_y = 0.0
 
         if len(self.pikmin_gen_view.selected) == 1:
             obj = self.pikmin_gen_view.selected[0]
@@ -699,7 +719,7 @@ class GenEditor(QMainWindow):
     def action_delete_objects(self):
         tobedeleted = []
         for obj in self.pikmin_gen_view.selected:
-            self.pikmin_gen_file.objects.remove(obj)
+            self.pikmin_gen_file.remove_object(obj)
             if obj in self.editing_windows:
                 self.editing_windows[obj].destroy()
                 del self.editing_windows[obj]
@@ -722,7 +742,7 @@ class GenEditor(QMainWindow):
 
         if action == "AddObject":
             obj = val
-            self.pikmin_gen_file.objects.remove(obj)
+            self.pikmin_gen_file.remove_object(obj)
             if obj in self.editing_windows:
                 self.editing_windows[obj].destroy()
                 del self.editing_windows[obj]
@@ -739,7 +759,7 @@ class GenEditor(QMainWindow):
 
         if action == "RemoveObjects":
             for obj in val:
-                self.pikmin_gen_file.objects.append(obj)
+                self.pikmin_gen_file.add_object(obj)
 
             #self.pikmin_gen_view.update()
             self.pikmin_gen_view.do_redraw()
@@ -755,14 +775,14 @@ class GenEditor(QMainWindow):
 
         if action == "AddObject":
             obj = val
-            self.pikmin_gen_file.objects.append(obj)
+            self.pikmin_gen_file.add_object(obj)
 
             #self.pikmin_gen_view.update()
             self.pikmin_gen_view.do_redraw()
 
         if action == "RemoveObjects":
             for obj in val:
-                self.pikmin_gen_file.objects.remove(obj)
+                self.pikmin_gen_file.remove_object(obj)
                 if obj in self.editing_windows:
                     self.editing_windows[obj].destroy()
                     del self.editing_windows[obj]
@@ -812,6 +832,10 @@ class GenEditor(QMainWindow):
                             if coord == "x": pikobject.set_rotation((val, None, None))
                             elif coord == "y": pikobject.set_rotation((None, val, None))
                             elif coord == "z": pikobject.set_rotation((None, None, val))
+
+                    columns = self.pikmin_gen_file.get_columns()
+                    if columns is not None:
+                        columns.update((pikobject,))
                     #self.pikmin_gen_view.update()
                     self.pikmin_gen_view.do_redraw()
                     if not self._justupdatingselectedobject:
@@ -836,6 +860,8 @@ class GenEditor(QMainWindow):
                         newobj = self.editing_windows[currentobj].get_content()
                         if newobj is not None:
                             currentobj.from_pikmin_object(newobj)
+                            # The type of the object can change as well
+                            self.pikmin_gen_file.invalidate_columns()
                             self.pik_control.set_info(currentobj,
                                                       (currentobj.x, currentobj.y, currentobj.z),
                                                       currentobj.get_rotation())
@@ -968,6 +994,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # Shared with the other editor so an archive only needs to be decompressed once
+    set_archive_cache(ArchiveCache(DEFAULT_PATH))
+
     app = QApplication(sys.argv)
 
     if platform.system() == "Windows":
@@ -983,9 +1012,8 @@ if __name__ == "__main__":
         pikmin_gui.setWindowIcon(QtGui.QIcon('resources/icon.ico'))
 
         if args.inputgen is not None:
-            with open(args.inputgen, "r", encoding="shift_jis-2004", errors="backslashreplace") as f:
-                pikmin_gen_file = PikminGenFile()
-                pikmin_gen_file.from_file(f)
+            pikmin_gen_file = PikminGenFile()
+            pikmin_gen_file.from_path(args.inputgen)
 
             pikmin_gui.setup_gen_file(pikmin_gen_file, args.inputgen)
 
@@ -1004,7 +1032,7 @@ if __name__ == "__main__":
 
             elif args.collision.endswith(".szs") or args.collision.endswith(".arc"):
                 with open(args.collision, "rb") as f:
-                    archive = Archive.from_file(f)
+                    archive = Archive.from_file(f, lazy=True)
                 f = archive["text/grid.bin"]
                 collision = py_obj.PikminCollision(f)
 
@@ -1023,7 +1051,7 @@ if __name__ == "__main__":
                     waterboxfile.from_file(f)
             elif args.waterbox.endswith(".szs") or args.waterbox.endwith(".arc"):
                 with open(args.waterbox, "rb") as f:
-                    archive = Archive.from_file(f)
+                    archive = Archive.from_file(f, lazy=True)
                     # try:
                     f = archive["text/waterbox.txt"]
                     # print(f.read())
@@ -64,11 +64,12 @@ ONION_COLORTABLE = {pikmingen.ONYN_ROCKET: QColor("grey"),
                     pikmingen.ONYN_REDONION: QColor(255, 55, 55),
                     pikmingen.ONYN_YELLOWONION: QColor(255, 212, 0)}
 
+# Keyed by the kind of the object, see PikminObject.get_kind
 OBJECT_SIZES = {
-    pikmingen.ONYN_BLUEONION: 47,
-    pikmingen.ONYN_REDONION: 47,
-    pikmingen.ONYN_YELLOWONION: 47,
-    pikmingen.ONYN_ROCKET: 55,
+    pikmingen.KIND_BLUEONION: 47,
+    pikmingen.KIND_REDONION: 47,
+    pikmingen.KIND_YELLOWONION: 47,
+    pikmingen.KIND_ROCKET: 55,
 }
 
 
@@ -239,49 +240,56 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
 
         self.testimage = TexturedPlane(100, 100, BRIDGE_GRAPHICS[pikmingen.BRIDGE_SHORT])
 
-        self.bridge_models = {pikmingen.BRIDGE_LONG: TexturedPlane(130, 360+80,
-                                                                   QtGui.QImage("resources/lbridge.png", "png")),
-                              pikmingen.BRIDGE_SHORT: TexturedPlane(130, 180+80,
-                                                                       QtGui.QImage("resources/sbridge.png", "png")),
-                              pikmingen.BRIDGE_SHORT_UP: TexturedPlane(130, 120+80,
-                                                                       QtGui.QImage("resources/ubridge.png", "png"))}
-
-        self.bridge_models[pikmingen.BRIDGE_SHORT].set_offset(0, (180+80)/2 - 42)
-        self.bridge_models[pikmingen.BRIDGE_LONG].set_offset(0, (360+80)/2 - 42)
-        self.bridge_models[pikmingen.BRIDGE_SHORT_UP].set_offset(0, (120+80)/2 - 42)
-
-        self.gate_models = {pikmingen.GATE_ELECTRIC: TexturedPlane(267, 35,
-                                                                   QtGui.QImage("resources/dgat.png", "png")),
-                            pikmingen.GATE_SAND: TexturedPlane(267, 70,
+        # The models are keyed by the kind of the object, see PikminObject.get_kind
+        self.bridge_models = {pikmingen.KIND_BRIDGE_LONG: TexturedPlane(130, 360+80,
+                                                                        QtGui.QImage("resources/lbridge.png", "png")),
+                              pikmingen.KIND_BRIDGE_SHORT: TexturedPlane(130, 180+80,
+                                                                         QtGui.QImage("resources/sbridge.png", "png")),
+                              pikmingen.KIND_BRIDGE_SHORT_UP: TexturedPlane(130, 120+80,
+                                                                            QtGui.QImage("resources/ubridge.png", "png"))}
+
+        self.bridge_models[pikmingen.KIND_BRIDGE_SHORT].set_offset(0, (180+80)/2 - 42)
+        self.bridge_models[pikmingen.KIND_BRIDGE_LONG].set_offset(0, (360+80)/2 - 42)
+        self.bridge_models[pikmingen.KIND_BRIDGE_SHORT_UP].set_offset(0, (120+80)/2 - 42)
+
+        self.gate_models = {pikmingen.KIND_ELECTRIC_GATE: TexturedPlane(267, 35,
+                                                                        QtGui.QImage("resources/dgat.png", "png")),
+                            pikmingen.KIND_GATE: TexturedPlane(267, 70,
                                                                QtGui.QImage("resources/gate.png", "png"))}
-        self.gate_models[pikmingen.GATE_ELECTRIC].set_offset(0, -10)
+        self.gate_models[pikmingen.KIND_ELECTRIC_GATE].set_offset(0, -10)
 
 
         self.onion_models = {
-            pikmingen.ONYN_BLUEONION: TexturedPlane(47*2, 47*2,
-                                                    QtGui.QImage("resources/generic_circle.png", "png")),
-            pikmingen.ONYN_REDONION: TexturedPlane(47*2, 47*2,
+            pikmingen.KIND_BLUEONION: TexturedPlane(47*2, 47*2,
                                                     QtGui.QImage("resources/generic_circle.png", "png")),
-            pikmingen.ONYN_YELLOWONION: TexturedPlane(47*2, 47*2,
-                                                    QtGui.QImage("resources/generic_circle.png", "png")),
-            pikmingen.ONYN_ROCKET: TexturedPlane(55*2, 55*2,
-                                                    QtGui.QImage("resources/generic_circle.png", "png"))
+            pikmingen.KIND_REDONION: TexturedPlane(47*2, 47*2,
+                                                   QtGui.QImage("resources/generic_circle.png", "png")),
+            pikmingen.KIND_YELLOWONION: TexturedPlane(47*2, 47*2,
+                                                      QtGui.QImage("resources/generic_circle.png", "png")),
+            pikmingen.KIND_ROCKET: TexturedPlane(55*2, 55*2,
+                                                 QtGui.QImage("resources/generic_circle.png", "png"))
         }
 
-        self.onion_models[pikmingen.ONYN_BLUEONION].set_color((0.0, 0.0, 1.0))
-        self.onion_models[pikmingen.ONYN_REDONION].set_color((255/255.0, 55/255.0, 55/255.0))
-        self.onion_models[pikmingen.ONYN_YELLOWONION].set_color((255/255.0, 212/255.0, 0.0))
-        self.onion_models[pikmingen.ONYN_ROCKET].set_color((0.5, 0.5, 0.5))
+        self.onion_models[pikmingen.KIND_BLUEONION].set_color((0.0, 0.0, 1.0))
+        self.onion_models[pikmingen.KIND_REDONION].set_color((255/255.0, 55/255.0, 55/255.0))
+        self.onion_models[pikmingen.KIND_YELLOWONION].set_color((255/255.0, 212/255.0, 0.0))
+        self.onion_models[pikmingen.KIND_ROCKET].set_color((0.5, 0.5, 0.5))
 
         self.downfloor_models = {
-            "0": TexturedPlane(100, 100,
-                               QtGui.QImage("resources/downfloor1.png", "png")),
-            "1": TexturedPlane(150, 120,
-                               QtGui.QImage("resources/downfloor2.png", "png")),
-            "2": TexturedPlane(256,197,
-                               QtGui.QImage("resources/paperbag.png", "png"))
+            pikmingen.KIND_SMALL_BLOCK: TexturedPlane(100, 100,
+                                                      QtGui.QImage("resources/downfloor1.png", "png")),
+            pikmingen.KIND_NORMAL_BLOCK: TexturedPlane(150, 120,
+                                                       QtGui.QImage("resources/downfloor2.png", "png")),
+            pikmingen.KIND_PAPER_BAG: TexturedPlane(256,197,
+                                                    QtGui.QImage("resources/paperbag.png", "png"))
         }
 
+        # All models that are drawn below items, so drawing needs only one lookup per item
+        self.item_models = {}
+        self.item_models.update(self.bridge_models)
+        self.item_models.update(self.gate_models)
+        self.item_models.update(self.downfloor_models)
+
         self.generic_object = TexturedPlane(20*2, 20*2, QtGui.QImage("resources/generic_circle.png", "png"))
 
         self.rotation_visualizer = glGenLists(1)
@@ -647,13 +655,13 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
                 objects = self.pikmin_generators.objects
                 for i, pikminobject in enumerate(objects):
                     x, y, z = pikminobject.x, pikminobject.y, pikminobject.z
-                    name = pikminobject.get_useful_object_name()
+                    onion_model = self.onion_models.get(pikminobject.get_kind())
 
                     glPushMatrix()
                     glTranslatef(x, -z, y + 2)
 
-                    if name in self.onion_models:
-                        self.onion_models[name].render_coloredid(i)
+                    if onion_model is not None:
+                        onion_model.render_coloredid(i)
                     else:
                         self.generic_object.render_coloredid(i)
 
@@ -719,13 +727,24 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
         if self.pikmin_generators is not None:
             selected = self.selected
             objects = self.pikmin_generators.objects
+            columns = self.pikmin_generators.get_columns()
+            if columns is not None:
+                # Reading the positions and selection state as columns is faster than
+                # checking every object against the list of selected objects
+                columns.set_selection(selected)
+                object_states = zip(columns.x.tolist(), columns.y.tolist(), columns.z.tolist(),
+                                    columns.selected.tolist())
+            else:
+                object_states = ((obj.x, obj.y, obj.z, obj in selected) for obj in objects)
+            onion_models = self.onion_models
+            item_models = self.item_models
             #links = self.pikmin_routes.links
             #for waypoint, wp_info in self.waypoints.items():
-            for pikminobject in objects:
-                x, y, z = pikminobject.x, pikminobject.y, pikminobject.z
+            for pikminobject, (x, y, z, is_selected) in zip(objects, object_states):
 
                 #glColor3f(1.0, 1.0, 1.0)
-                name = pikminobject.get_useful_object_name()
+                kind = pikminobject.get_kind()
+                onion_model = onion_models.get(kind)
                 glPushMatrix()
                 glColor4f(1.0, 1.0, 1.0, 1.0)
                 if pikminobject.object_type == "{item}":
@@ -733,24 +752,14 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
                     glTranslatef(x, -z, y + 1)
                     glRotate(angle + 180, 0, 0, 1)
 
-                    if name in self.bridge_models:
-                        model = self.bridge_models[name]
+                    model = item_models.get(kind)
+                    if model is not None:
                         model.render()
-                    elif name in self.gate_models:
-                        model = self.gate_models[name]
-                        model.render()
-                    else:
-                        itemdata = pikminobject._object_data[0]
-                        if itemdata[0] == "{dwfl}":
-                            downfloortype = itemdata[4]
-                            if downfloortype in self.downfloor_models:
-                                model = self.downfloor_models[downfloortype]
-                                model.render()
-
-                if pikminobject in selected:
+
+                if is_selected:
                     glColor4f(1.0, 0.0, 0.0, 1.0)
-                elif name in self.onion_models:
-                    self.onion_models[name].apply_color()
+                elif onion_model is not None:
+                    onion_model.apply_color()
                 else:
                     glColor4f(0.0, 0.0, 0.0, 1.0)
 
@@ -761,12 +770,12 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
                 angle = pikminobject.get_horizontal_rotation()
                 if angle is not None:
                     glRotate(angle + 180, 0, 0, 1)
-                if name in self.onion_models:
-                    self.onion_models[name].render()
+                if onion_model is not None:
+                    onion_model.render()
                 else:
                     self.generic_object.render()
 
-                if pikminobject in selected:
+                if is_selected:
                     angle = pikminobject.get_horizontal_rotation()
                     if angle is not None:
                         #glRotate(angle + 180, 0, 0, 1)
@@ -834,12 +843,7 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
                     hit = False
                     all_hit_waypoints = []
                     for pikminobject in self.pikmin_generators.objects:
-                        name = pikminobject.get_useful_object_name()
-
-                        if name in OBJECT_SIZES:
-                            size = OBJECT_SIZES[name]
-                        else:
-                            size = ENTITY_SIZE
+                        size = OBJECT_SIZES.get(pikminobject.get_kind(), ENTITY_SIZE)
 
                         #if abs(mouse_x-objx) <= size and abs(mouse_z - objz) <= size:
                         if abs(selectstartx-pikminobject.x) <= size//2 and abs(selectstartz+pikminobject.z) <= size//2:
@@ -1068,7 +1072,10 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
 
                 selected = []
                 #centerx, centerz = 0, 0
-                if self.pikmin_generators is not None:
+                columns = self.pikmin_generators.get_columns() if self.pikmin_generators is not None else None
+                if columns is not None:
+                    selected = columns.in_rectangle(selectstartx, selectstartz, selectendx, selectendz)
+                elif self.pikmin_generators is not None:
                     for pikminobject in self.pikmin_generators.objects:
                         #objx, objz = (pikminobject.x - midx)*scalex, (pikminobject.z - midz)*scalez
                         way_x = pikminobject.x
@@ -25,7 +25,8 @@ import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtCore as QtCore
 
 from libpiktxt import RouteTxt
-from lib.rarc import Archive
+from lib.rarc import Archive, set_archive_cache
+from lib.archive_cache import ArchiveCache, DEFAULT_PATH
 
 import custom_widgets
 from custom_widgets import (MapViewer,
@@ -227,7 +228,7 @@ class EditorMainWindow(QMainWindow):
 
             with open(filepath, "rb") as f:
                 if load_from_arc:
-                    archive = Archive.from_file(f)
+                    archive = Archive.from_file(f, lazy=True)
                     f = archive["text/grid.bin"]
                 collision = PikminCollision(f)
 
@@ -601,6 +602,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # Shared with the other editor so an archive only needs to be decompressed once
+    set_archive_cache(ArchiveCache(DEFAULT_PATH))
+
     app = QApplication(sys.argv)
 
     if platform.system() == "Windows":
@@ -627,7 +631,7 @@ if __name__ == "__main__":
 
         elif args.collision.endswith(".szs") or args.collision.endswith(".arc"):
             with open(args.collision, "rb") as f:
-                archive = Archive.from_file(f)
+                archive = Archive.from_file(f, lazy=True)
                 f = archive["text/grid.bin"]
                 collision = PikminCollision(f)
 